@@ -1,25 +1,46 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+import time
+_inicio_arranque = time.perf_counter()
+
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, g, Response, stream_template, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-import sqlite3
 import os
+import json
+import base64
+import itertools
+import logging
+import threading
+import zlib
 from datetime import datetime
-import shutil
-from data_structures import LinkedList, FIFOSort
+from data_structures import FilaEspera
+from db import Database
+import stats
+from events import Broadcaster, format_sse
+from cache import TTLCache
+from backup import BackupManager
+from queue_ops import claim_next
+from scheduler import Agendador, duracoes_servico
+import metrics
+import bulk
+import archive
+import notifications
+import search
+import customers
+import changes
+import heatmap
 from dotenv import load_dotenv
 from init_db import init_db
 
-init_db()
-# 🔹 Inicializar conexão PostgreSQL
-init_app(app)
-
-# 🔹 Criar as tabelas no banco PostgreSQL
-with app.app_context():
-    db.create_all()
 app = Flask(__name__)
 load_dotenv()
 app.secret_key = os.getenv('SECRET_KEY', 'troque_esta_chave_por_uma_segura')
 DB_PATH = os.getenv('DB_PATH', 'clientes_hair_salon.db')
 
+# Camada de dados única (SQLite ou PostgreSQL conforme DATABASE_URL), com um
+# pool de conexões por worker; cada requisição usa uma única conexão
+database = Database.from_env(DB_PATH, factory=metrics.InstrumentedConnection)
+# Migrações versionadas: com o esquema em dia é só uma leitura da versão
+_, versao_esquema = init_db(database)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -30,79 +51,191 @@ class User(UserMixin):
         self.username = username
         self.role = role
 
+# Utilizadores carregados recentemente: evita uma consulta por requisição autenticada.
+# A aplicação não altera usuarios; o TTL limita quanto tempo uma alteração feita
+# diretamente na base (papel, palavra-passe) demora a ser vista.
+usuarios_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', '128')),
+                          ttl=float(os.getenv('USER_CACHE_TTL', '60')))
+
 @login_manager.user_loader
 def load_user(user_id):
+    user = usuarios_cache.get(str(user_id))
+    if user is not None:
+        return user
     conn = get_conn()
     cur = conn.cursor()
     cur.execute('SELECT id, username, role FROM usuarios WHERE id = ?', (user_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         return None
-    return User(row['id'], row['username'], row['role'])
+    user = User(row['id'], row['username'], row['role'])
+    usuarios_cache.set(str(user_id), user)
+    return user
 
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def build_fifo_queue(rows):
-    """Constrói fila FIFO (primeiro a chegar, primeiro a ser atendido)"""
-    fila = LinkedList()
-    
-    for r in rows:
-        fila.append(
-            r['id'],
-            r['nome'],
-            r['telefone'],
-            r['servico_id'],
-            r['created_at']
-        )
-    
-    fila_ordenada = FIFOSort.sort_linked_list(fila)
-    return fila_ordenada
+    """Retorna a conexão da requisição atual, obtida do pool no primeiro uso"""
+    if 'db_conn' not in g:
+        g.db_conn = database.acquire()
+    return g.db_conn
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def record_metrics(response):
+    """Latência da rota e contagem de SQL da requisição, agregadas em /metrics"""
+    inicio = g.pop('request_start', None)
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.finish_request(rota, request.method, response.status_code, time.perf_counter() - inicio)
+    return response
+
+@app.teardown_appcontext
+def release_conn(exc):
+    """Devolve a conexão da requisição ao pool"""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        database.release(conn)
+
+# Backups online com rotação (opcionalmente agendados com BACKUP_INTERVAL em segundos).
+# Só para SQLite: no PostgreSQL os backups ficam a cargo do servidor (pg_dump).
+backups = None
+if database.dialeto == 'sqlite':
+    backups = BackupManager(
+        database.db_path,
+        destino=os.getenv('BACKUP_DIR', 'backups'),
+        retencao=int(os.getenv('BACKUP_RETENCAO', '7')),
+        comprimir=os.getenv('BACKUP_GZIP', '1') == '1',
+    )
+    if os.getenv('BACKUP_INTERVAL'):
+        backups.agendar(int(os.getenv('BACKUP_INTERVAL')))
+
+# Fila de espera persistente do processo: carregada uma vez e depois
+# atualizada incrementalmente pelas rotas que alteram a fila
+fila_espera = FilaEspera()
+
+# Previsão de espera por cliente com NUM_CADEIRAS cadeiras em paralelo;
+# acompanha a fila em memória e é recarregado junto com ela
+agendador = Agendador(cadeiras=int(os.getenv('NUM_CADEIRAS', '1')))
+
+# Avisos aos próximos NOTIFY_AHEAD clientes: /next só escreve no outbox e o envio
+# corre na thread do despachante (NOTIFY_DISPATCH=thread) ou num processo à parte
+# (NOTIFY_DISPATCH=process, com `python notifications.py`). Sem NOTIFY_SENDER a
+# thread não arranca e os avisos ficam pendentes.
+despachante = notifications.Despachante(
+    database,
+    lote=int(os.getenv('NOTIFY_BATCH', '50')),
+    taxa=float(os.getenv('NOTIFY_RATE', '5')),
+)
+if os.getenv('NOTIFY_DISPATCH', 'thread') == 'thread':
+    despachante.iniciar()
+
+# Acorda os streams SSE do painel deste worker quando a fila muda
+painel_eventos = Broadcaster()
+SSE_KEEPALIVE = int(os.getenv('SSE_KEEPALIVE', '15'))
+SSE_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', '300'))
+# Streams abertos em simultâneo por worker; deve ficar abaixo de --threads (ver Procfile)
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '16'))
+streams_livres = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# Respostas iguais para todos os visitantes entre duas escritas (painel, contadores).
+# As escritas de outros workers chegam pelo observador de versões; o TTL só cobre
+# escritas feitas diretamente na base sem publicar a versão.
+respostas = TTLCache(maxsize=int(os.getenv('CACHE_MAXSIZE', '256')), ttl=float(os.getenv('CACHE_TTL', '60')))
+painel_versao = {'etag': None, 'last_modified': None}
+
+def alteracoes_externas(chaves):
+    """Outro processo alterou a fila ou os atendimentos: descarta o estado em memória afetado"""
+    # A fila e o agendador (clientes em serviço) são recarregados juntos no próximo acesso
+    fila_espera.carregada = False
+    if 'fila' in chaves:
+        respostas.invalidate()
+        painel_eventos.publish()
+    else:
+        respostas.invalidate('contadores')
+
+observador = changes.Observador(alteracoes_externas)
+
+# Mapas de calor por período, válidos até um novo atendimento ser finalizado
+# (a versão 'atendimentos' faz parte da chave; as entradas antigas saem por LRU)
+mapas_calor = TTLCache(maxsize=8, ttl=float(os.getenv('HEATMAP_CACHE_TTL', '3600')))
+
+def sincronizar():
+    """Aplica as alterações de outros workers, uma vez por requisição (um PRAGMA se nada mudou)"""
+    if 'sincronizado' not in g:
+        g.sincronizado = True
+        observador.verificar(get_conn())
+
+def fila_alterada():
+    """Invalida o cache, acorda os streams do painel e avisa os outros workers após uma escrita na fila"""
+    respostas.invalidate()
+    painel_eventos.publish()
+    observador.publicar(get_conn(), 'fila')
+
+def get_fila():
+    """Retorna a fila de espera em memória, carregando-a no primeiro uso ou se outro worker a alterou"""
+    sincronizar()
+    if not fila_espera.carregada:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT id, nome, telefone, created_at, servico_id
+            FROM clientes
+            WHERE status = 'espera'
+            ORDER BY created_at ASC, id ASC
+        ''')
+        rows = cur.fetchall()
+        cur.execute('SELECT id, servico_id, chamada FROM atendimentos WHERE saida IS NULL')
+        em_servico = cur.fetchall()
+        agendador.load(rows, em_servico, duracoes_servico(cur))
+        fila_espera.load(rows)
+    return fila_espera
+
+def get_agendador():
+    """Retorna o agendador, carregado junto com a fila de espera"""
+    get_fila()
+    return agendador
+
+def enqueue_cliente(cur, cliente_id):
+    """Coloca na fila em memória um cliente acabado de inserir"""
+    cur.execute('SELECT id, nome, telefone, servico_id, created_at FROM clientes WHERE id = ?', (cliente_id,))
+    row = cur.fetchone()
+    if row:
+        get_fila().enqueue(row['id'], row['nome'], row['telefone'], row['servico_id'], row['created_at'])
+        agendador.entrar(row['id'], row['servico_id'])
 
 def average_wait_seconds():
+    """Tempo médio de espera lido dos agregados acumulados (O(1))"""
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT entrada, chamada FROM atendimentos WHERE entrada IS NOT NULL AND chamada IS NOT NULL")
-    rows = cur.fetchall()
-    conn.close()
-    deltas = []
-    for r in rows:
-        try:
-            entrada = datetime.strptime(r['entrada'], '%Y-%m-%d %H:%M:%S')
-            chamada = datetime.strptime(r['chamada'], '%Y-%m-%d %H:%M:%S')
-            deltas.append((chamada - entrada).total_seconds())
-        except Exception:
-            pass
-    if not deltas:
-        return None
-    return sum(deltas) / len(deltas)
+    return stats.media_espera(cur)
+
+def contadores():
+    """Contadores do início e do painel, calculados uma vez até a próxima escrita"""
+    def calcular():
+        conn = get_conn()
+        cur = conn.cursor()
+        # Tabelas vivas mais os totais já arquivados
+        clientes_arquivados, atendimentos_arquivados = archive.totais_arquivados(cur)
+        cur.execute('SELECT COUNT(*) as c FROM clientes')
+        total = cur.fetchone()['c'] + clientes_arquivados
+        cur.execute('SELECT COUNT(*) as c FROM atendimentos')
+        atendidos = cur.fetchone()['c'] + atendimentos_arquivados
+        
+        cur.execute("SELECT COUNT(*) as c FROM clientes WHERE status = 'espera'")
+        espera = cur.fetchone()['c']
+        
+        avg = average_wait_seconds()
+        avg_min = round(avg/60, 1) if avg else None
+        return {'total': total, 'atendidos': atendidos, 'espera': espera, 'avg_min': avg_min}
+    sincronizar()
+    return respostas.get_or_set('contadores', calcular)
 
 @app.route('/')
 def index():
-    avg = average_wait_seconds()
-    avg_min = round(avg/60, 1) if avg else None
-    
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('SELECT COUNT(*) as c FROM clientes')
-    total = cur.fetchone()['c']
-    cur.execute('SELECT COUNT(*) as c FROM atendimentos')
-    atendidos = cur.fetchone()['c']
-    
-    cur.execute('''
-        SELECT COUNT(*) as c FROM clientes c
-        LEFT JOIN (
-            SELECT cliente_id, MAX(id) as ultimo FROM atendimentos GROUP BY cliente_id
-        ) a ON a.cliente_id = c.id
-        WHERE a.ultimo IS NULL
-    ''')
-    espera = cur.fetchone()['c']
-    conn.close()
-    
-    return render_template('index.html', total=total, atendidos=atendidos, espera=espera, avg_min=avg_min)
+    return render_template('index.html', **contadores())
 
 @app.route('/login', methods=['GET','POST'])
 def login():
@@ -113,9 +246,10 @@ def login():
         cur = conn.cursor()
         cur.execute('SELECT id, username, role, password FROM usuarios WHERE username = ?', (username,))
         row = cur.fetchone()
-        conn.close()
         if row and row['password'] == password:
             user = User(row['id'], row['username'], row['role'])
+            # Um novo login lê sempre os dados atuais do utilizador
+            usuarios_cache.set(str(user.id), user)
             login_user(user)
             flash('Login efetuado com sucesso!', 'success')
             return redirect(url_for('dashboard'))
@@ -137,37 +271,130 @@ def add():
     cur = conn.cursor()
     cur.execute('SELECT id, nome, preco, duracao_estimada FROM servicos')
     servicos = cur.fetchall()
-    conn.close()
     
     if request.method == 'POST':
         nome = request.form['nome']
         telefone = request.form.get('telefone') or None
         servico = request.form.get('servico') or None
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute('INSERT INTO clientes (nome, telefone, servico_id) VALUES (?,?,?)',
-                    (nome, telefone, servico))
+        identidade = customers.identificar(cur, nome, telefone)
+        cur.execute('INSERT INTO clientes (nome, telefone, servico_id, identidade_id) VALUES (?,?,?,?) RETURNING id',
+                    (nome, telefone, servico, identidade))
+        cliente_id = cur.fetchone()[0]
         conn.commit()
-        conn.close()
+        enqueue_cliente(cur, cliente_id)
+        fila_alterada()
         flash('Cliente adicionado à fila com sucesso!', 'success')
         return redirect(url_for('list_clientes'))
     return render_template('add.html', servicos=servicos)
 
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '50'))
+ESTADOS = ('espera', 'atendimento', 'concluido')
+
+def encode_cursor(*valores):
+    """Cursor opaco da paginação por chave (keyset) para usar na URL"""
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+def decode_cursor(cursor):
+    """(texto, id) do último registo da página anterior; um cursor inválido conta como nenhum"""
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    # Os cursores da /list e da /servicos são sempre [created_at ou nome, id]
+    if (not isinstance(valores, list) or len(valores) != 2 or not isinstance(valores[0], str)
+            or not isinstance(valores[1], int) or isinstance(valores[1], bool)):
+        return None
+    return valores
+
+def page_args():
+    """Lê cursor, tamanho da página e posição inicial da query string"""
+    cursor = decode_cursor(request.args.get('cursor', ''))
+    limite = min(max(request.args.get('limite', PAGE_SIZE, type=int), 1), 500)
+    inicio = max(request.args.get('inicio', 0, type=int), 0)
+    return cursor, limite, inicio
+
+def peek_rows(cur):
+    """Itera o cursor sem carregar tudo, preservando o teste `if linhas` nos templates"""
+    primeira = cur.fetchone()
+    if primeira is None:
+        return []
+    return itertools.chain([primeira], cur)
+
 @app.route('/list')
 @login_required
 def list_clientes():
+    """
+    Lista de clientes paginada por chave (created_at, id), com filtro de estado
+    Com ?stream=1 a lista completa é enviada em streaming, sem a carregar em memória
+    """
+    estado = request.args.get('estado', '')
+    if estado not in ESTADOS:
+        estado = ''
+    stream = request.args.get('stream') == '1'
+    cursor, limite, inicio = page_args()
+    
+    filtros = []
+    params = []
+    if estado:
+        # Literal (e não parâmetro) para o SQLite poder usar o índice parcial de espera
+        filtros.append(f"c.status = '{estado}'")
+    if cursor and not stream:
+        filtros.append('(c.created_at, c.id) > (?, ?)')
+        params.extend(cursor)
+    where = ('WHERE ' + ' AND '.join(filtros)) if filtros else ''
+    
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute('''
-        SELECT c.id, c.nome, c.telefone, c.created_at, 
+    sql = f'''
+        SELECT c.id, c.nome, c.telefone, c.created_at, c.status,
                s.nome as servico, s.preco, s.duracao_estimada
         FROM clientes c 
         LEFT JOIN servicos s ON c.servico_id = s.id
-        ORDER BY c.created_at ASC
-    ''')
+        {where}
+        ORDER BY c.created_at ASC, c.id ASC
+    '''
+    
+    if stream:
+        cur.execute(sql, params)
+        return Response(stream_with_context(stream_template(
+            'list.html', clientes=peek_rows(cur), estado=estado, inicio=0, proximo=None, stream=True
+        )))
+    
+    cur.execute(sql + ' LIMIT ?', params + [limite + 1])
     clientes = cur.fetchall()
-    conn.close()
-    return render_template('list.html', clientes=clientes)
+    proximo = None
+    if len(clientes) > limite:
+        clientes = clientes[:limite]
+        ultimo = clientes[-1]
+        proximo = url_for('list_clientes', estado=estado or None, limite=limite,
+                          inicio=inicio + limite, cursor=encode_cursor(ultimo['created_at'], ultimo['id']))
+    return render_template('list.html', clientes=clientes, estado=estado, inicio=inicio, proximo=proximo, stream=False)
+
+@app.route('/clientes/search')
+@login_required
+def search_clientes():
+    """Typeahead de clientes por prefixo do nome ou do telefone (?q=...&limite=...)"""
+    limite = min(max(request.args.get('limite', search.LIMITE, type=int), 1), 100)
+    rows = search.pesquisar(get_conn(), request.args.get('q', ''), limite)
+    return jsonify({'clientes': [
+        {'id': r['id'], 'nome': r['nome'], 'telefone': r['telefone'], 'status': r['status'], 'created_at': r['created_at']}
+        for r in rows
+    ]})
+
+@app.route('/identidades/<int:id>')
+@login_required
+def historico_cliente(id):
+    """Cliente habitual (identificado pelo telefone) e as suas visitas, incluindo as arquivadas"""
+    cur = get_conn().cursor()
+    cur.execute('SELECT id, nome, telefone, primeira_visita, ultima_visita FROM identidades WHERE id = ?', (id,))
+    identidade = cur.fetchone()
+    if identidade is None:
+        return jsonify({'erro': 'cliente não encontrado'}), 404
+    visitas = customers.historico(cur, id, min(max(request.args.get('limite', 50, type=int), 1), 500))
+    return jsonify({
+        'identidade': dict(identidade),
+        'visitas': [dict(v) for v in visitas],
+    })
 
 @app.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
@@ -180,10 +407,19 @@ def edit_cliente(id):
         telefone = request.form.get('telefone') or None
         servico = request.form.get('servico') or None
         
-        cur.execute('UPDATE clientes SET nome=?, telefone=?, servico_id=? WHERE id=?',
-                    (nome, telefone, servico, id))
+        # Um telefone corrigido liga a visita à identidade desse número
+        cur.execute('SELECT created_at FROM clientes WHERE id = ?', (id,))
+        row = cur.fetchone()
+        identidade = customers.identificar(cur, nome, telefone, row['created_at']) if row else None
+        cur.execute('UPDATE clientes SET nome=?, telefone=?, servico_id=?, identidade_id=? WHERE id=?',
+                    (nome, telefone, servico, identidade, id))
         conn.commit()
-        conn.close()
+        cur.execute('SELECT servico_id FROM clientes WHERE id = ?', (id,))
+        row = cur.fetchone()
+        if row:
+            get_fila().update(id, nome, telefone, row['servico_id'])
+            agendador.alterar_servico(id, row['servico_id'])
+        fila_alterada()
         flash('Cliente atualizado com sucesso!', 'success')
         return redirect(url_for('list_clientes'))
     
@@ -191,7 +427,6 @@ def edit_cliente(id):
     cliente = cur.fetchone()
     cur.execute('SELECT id, nome, preco FROM servicos')
     servicos = cur.fetchall()
-    conn.close()
     
     return render_template('edit.html', cliente=cliente, servicos=servicos)
 
@@ -201,46 +436,41 @@ def delete_cliente(id):
     conn = get_conn()
     cur = conn.cursor()
     cur.execute('DELETE FROM clientes WHERE id = ?', (id,))
+    notifications.cancelar(cur, id)
     conn.commit()
-    conn.close()
+    get_fila().remove(id)
+    agendador.sair(id)
+    fila_alterada()
     flash('Cliente removido', 'warning')
     return redirect(url_for('list_clientes'))
 
 @app.route('/next', methods=['POST'])
 @login_required
 def chamar_proximo():
+    # A base decide quem é chamado (reserva atómica); a fila em memória apenas acompanha
+    fila = get_fila()
+    esperado = fila.peek()
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT c.id, c.nome, c.telefone, c.created_at, c.servico_id
-        FROM clientes c
-        LEFT JOIN (
-            SELECT cliente_id, MAX(id) as ultimo FROM atendimentos GROUP BY cliente_id
-        ) a ON a.cliente_id = c.id
-        LEFT JOIN atendimentos att ON att.id = a.ultimo
-        WHERE a.ultimo IS NULL
-    ''')
-    rows = cur.fetchall()
-    
-    if not rows:
-        conn.close()
-        return jsonify({'status': 'empty'}), 200
-
-    fila = build_fifo_queue(rows)
-    
-    primeiro = fila.remove_head()
+    # Até aqui só houve leituras (no PostgreSQL abrem transação): terminá-la antes da reserva
+    conn.rollback()
+    primeiro = claim_next(conn)
     
     if not primeiro:
-        conn.close()
+        if esperado:
+            fila_espera.carregada = False
         return jsonify({'status': 'empty'}), 200
 
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cur.execute('INSERT INTO atendimentos (cliente_id, entrada, chamada, servico_id) VALUES (?,?,?,?)',
-                (primeiro.cliente_id, now, now, primeiro.servico_id))
-    conn.commit()
-    conn.close()
+    if esperado is None or esperado.cliente_id != primeiro['id']:
+        # Outro worker alterou a fila: recarregar no próximo acesso
+        fila_espera.carregada = False
+    fila.remove(primeiro['id'])
+    agendador.sair(primeiro['id'])
+    agendador.iniciar(primeiro['atendimento_id'], primeiro['servico_id'])
+    fila_alterada()
+    if notifications.enfileirar_proximos(conn):
+        despachante.acordar()
 
-    return jsonify({'status': 'ok', 'cliente': {'id': primeiro.cliente_id, 'nome': primeiro.nome, 'telefone': primeiro.telefone}})
+    return jsonify({'status': 'ok', 'cliente': {'id': primeiro['id'], 'nome': primeiro['nome'], 'telefone': primeiro['telefone']}})
 
 @app.route('/finish/<int:atendimento_id>', methods=['POST'])
 @login_required
@@ -250,110 +480,248 @@ def finish_atendimento(atendimento_id):
     
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute('SELECT entrada FROM atendimentos WHERE id = ?', (atendimento_id,))
+    cur.execute('SELECT entrada, chamada, servico_id FROM atendimentos WHERE id = ?', (atendimento_id,))
     row = cur.fetchone()
     
     if not row:
-        conn.close()
         flash('Atendimento não encontrado', 'danger')
         return redirect(url_for('atendimento_atual'))
     
+    # Duração do atendimento: desde a chamada (entrada é a chegada à fila)
     try:
-        entrada = datetime.strptime(row['entrada'], '%Y-%m-%d %H:%M:%S')
+        inicio = datetime.strptime(row['chamada'] or row['entrada'], '%Y-%m-%d %H:%M:%S')
         saida_dt = datetime.strptime(now, '%Y-%m-%d %H:%M:%S')
-        tempo = int((saida_dt - entrada).total_seconds())
+        tempo = int((saida_dt - inicio).total_seconds())
     except Exception:
         tempo = None
     
+    # Só a primeira finalização escreve e agrega: a condição saida IS NULL está na
+    # própria escrita, por isso uma segunda finalização (ou duas em simultâneo)
+    # não sobrepõe o valor pago nem conta o atendimento duas vezes
     if valor_pago:
-        cur.execute('UPDATE atendimentos SET saida = ?, tempo_atendimento = ?, valor_pago = ? WHERE id = ?', 
+        cur.execute('UPDATE atendimentos SET saida = ?, tempo_atendimento = ?, valor_pago = ? WHERE id = ? AND saida IS NULL',
                     (now, tempo, float(valor_pago), atendimento_id))
     else:
-        cur.execute('UPDATE atendimentos SET saida = ?, tempo_atendimento = ? WHERE id = ?', 
+        cur.execute('UPDATE atendimentos SET saida = ?, tempo_atendimento = ? WHERE id = ? AND saida IS NULL',
                     (now, tempo, atendimento_id))
-    
+    if cur.rowcount != 1:
+        conn.rollback()
+        flash('Atendimento já finalizado', 'warning')
+        return redirect(url_for('atendimento_atual'))
+    cur.execute("""
+        UPDATE clientes SET status = 'concluido'
+        WHERE id = (SELECT cliente_id FROM atendimentos WHERE id = ?)
+    """, (atendimento_id,))
+    stats.registrar_atendimento(cur, now, tempo)
+    stats.registrar_rollup(cur, now, row['servico_id'], float(valor_pago) if valor_pago else None, tempo)
+
     conn.commit()
-    conn.close()
+    agendador.terminar(atendimento_id)
+    respostas.invalidate('contadores')
+    observador.publicar(conn, 'atendimentos')
     flash('Atendimento finalizado com sucesso!', 'success')
     return redirect(url_for('atendimento_atual'))
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    cur.execute('SELECT COUNT(*) as c FROM clientes')
-    total = cur.fetchone()['c']
-    cur.execute('SELECT COUNT(*) as c FROM atendimentos')
-    atendidos = cur.fetchone()['c']
-    
-    cur.execute('''
-        SELECT COUNT(*) as c FROM clientes c
-        LEFT JOIN (
-            SELECT cliente_id, MAX(id) as ultimo FROM atendimentos GROUP BY cliente_id
-        ) a ON a.cliente_id = c.id
-        WHERE a.ultimo IS NULL
-    ''')
-    espera = cur.fetchone()['c']
-
-    avg_secs = average_wait_seconds()
-    avg_min = round(avg_secs/60, 1) if avg_secs else None
-
-    conn.close()
-    return render_template('dashboard.html', total=total, atendidos=atendidos, espera=espera, avg_min=avg_min)
+    return render_template('dashboard.html', **contadores())
 
 @app.route('/painel')
 def painel_publico():
-    return render_template('painel.html')
+    return render_template('painel.html', cliente_id=request.args.get('cliente', type=int), sse_retry=SSE_KEEPALIVE)
+
+def minutos(segundos):
+    return None if segundos is None else int(round(segundos / 60))
+
+@app.route('/fila/previsao/<int:cliente_id>')
+def previsao_espera(cliente_id):
+    """Posição e espera estimada de um cliente - O(log n), sem consultar a base"""
+    ag = get_agendador()
+    posicao = ag.posicao(cliente_id)
+    if posicao is None:
+        return jsonify({'status': 'fora_da_fila'})
+    return jsonify({'status': 'ok', 'posicao': posicao, 'espera_min': minutos(ag.previsao(cliente_id))})
 
 @app.route('/painel-next')
 def painel_next():
-    conn = get_conn()
-    cur = conn.cursor()
+    sincronizar()
+    resposta = respostas.get('painel')
+    if resposta is None:
+        primeiro = get_fila().peek()
+        if not primeiro:
+            payload = {'status': 'empty'}
+        else:
+            payload = {'status': 'ok', 'cliente': {'id': primeiro.cliente_id, 'nome': primeiro.nome, 'telefone': primeiro.telefone}}
+        body = json.dumps(payload, sort_keys=True)
+        etag = format(zlib.crc32(body.encode()), 'x')
+        # Last-Modified só avança quando o conteúdo muda de facto
+        if etag != painel_versao['etag']:
+            painel_versao['etag'] = etag
+            painel_versao['last_modified'] = datetime.utcnow().replace(microsecond=0)
+        resposta = (body, etag, painel_versao['last_modified'])
+        respostas.set('painel', resposta)
+    
+    body, etag, last_modified = resposta
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def painel_payload(cur):
+    """Primeiro cliente da fila lido da base (índice parcial, LIMIT 1)"""
     cur.execute('''
-        SELECT c.id, c.nome, c.telefone, c.created_at, c.servico_id
-        FROM clientes c
-        LEFT JOIN (
-            SELECT cliente_id, MAX(id) as ultimo FROM atendimentos GROUP BY cliente_id
-        ) a ON a.cliente_id = c.id
-        WHERE a.ultimo IS NULL
+        SELECT id, nome, telefone FROM clientes
+        WHERE status = 'espera'
+        ORDER BY created_at ASC, id ASC
+        LIMIT 1
     ''')
-    rows = cur.fetchall()
-    conn.close()
-    
-    if not rows:
-        return jsonify({'status': 'empty'})
-    
-    fila = build_fifo_queue(rows)
-    
-    if len(fila) == 0:
-        return jsonify({'status': 'empty'})
-    
-    primeiro = fila.head
-    return jsonify({'status': 'ok', 'cliente': {'id': primeiro.cliente_id, 'nome': primeiro.nome, 'telefone': primeiro.telefone}})
+    row = cur.fetchone()
+    if not row:
+        return {'status': 'empty'}
+    return {'status': 'ok', 'cliente': {'id': row['id'], 'nome': row['nome'], 'telefone': row['telefone']}}
+
+@app.route('/painel/stream')
+def painel_stream():
+    """Server-Sent Events: envia o próximo cliente apenas quando ele muda"""
+    # Cada stream ocupa uma thread do worker enquanto está aberto: acima de
+    # SSE_MAX_STREAMS o painel volta a consultar /painel-next (em cache), para
+    # sobrarem threads para /next, /finish e as restantes rotas
+    if not streams_livres.acquire(blocking=False):
+        metrics.registry.inc('sse_streams_rejected_total', {})
+        return Response('Painel sem vagas para streaming\n', status=503, headers={'Retry-After': str(SSE_KEEPALIVE)})
+    ultimo_id = request.headers.get('Last-Event-ID')
+
+    def gerar():
+        enviado = ultimo_id
+        versao = None
+        inicio = time.monotonic()
+        # Intervalo de reconexão do EventSource
+        yield 'retry: 3000\n\n'
+        while time.monotonic() - inicio < SSE_MAX_SECONDS:
+            # A cabeça da fila só é lida de novo quando a versão do painel avança
+            if versao != painel_eventos.versao:
+                versao = painel_eventos.versao
+                conn = database.acquire()
+                try:
+                    payload = painel_payload(conn.cursor())
+                finally:
+                    database.release(conn)
+                data = json.dumps(payload, sort_keys=True)
+                event_id = format(zlib.crc32(data.encode()), 'x')
+                if event_id != enviado:
+                    enviado = event_id
+                    yield format_sse(data, event='painel', id_=event_id)
+            if painel_eventos.wait(versao, SSE_KEEPALIVE) == versao:
+                # Nada mudou neste worker: o observador confirma (PRAGMA data_version no
+                # SQLite) se outro worker alterou a fila; se sim, publica no painel_eventos
+                conn = database.acquire()
+                try:
+                    observador.verificar(conn)
+                finally:
+                    database.release(conn)
+                yield ': keep-alive\n\n'
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(gerar(), mimetype='text/event-stream', headers=headers)
+    response.call_on_close(streams_livres.release)
+    return response
+
+@app.route('/cache/stats')
+@login_required
+def cache_stats():
+    """Acertos/falhas dos caches deste worker"""
+    return jsonify({'respostas': respostas.stats(), 'usuarios': usuarios_cache.stats()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas do worker no formato de texto do Prometheus"""
+    extras = []
+    for nome, cache in (('respostas', respostas), ('usuarios', usuarios_cache)):
+        estado = cache.stats()
+        extras.append(('cache_hits_total', {'cache': nome}, estado['hits'], 'counter'))
+        extras.append(('cache_misses_total', {'cache': nome}, estado['misses'], 'counter'))
+    extras.append(('queue_waiting', {}, len(fila_espera), 'gauge'))
+    extras.append(('app_startup_seconds', {}, startup_seconds, 'gauge'))
+    extras.append(('schema_version', {}, versao_esquema, 'gauge'))
+    # As métricas db_* valem para os dois backends; esta diz qual está em uso
+    extras.append(('db_backend_info', {'backend': database.dialeto}, 1, 'gauge'))
+    return Response(metrics.registry.render(extras), mimetype='text/plain; version=0.0.4')
+
+@app.route('/export/<tabela>')
+@login_required
+def export_tabela(tabela):
+    """Exporta clientes, atendimentos ou serviços em CSV/NDJSON, em streaming"""
+    formato = request.args.get('formato', 'csv')
+    if tabela not in bulk.TABELAS or formato not in bulk.FORMATOS:
+        return jsonify({'erro': 'tabela ou formato inválido'}), 400
+    mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    headers = {'Content-Disposition': f'attachment; filename={tabela}.{formato}'}
+    return Response(stream_with_context(bulk.exportar(get_conn(), tabela, formato)),
+                    mimetype=mimetype, headers=headers)
 
 @app.route('/backup')
 @login_required
 def backup_db():
-    now = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_name = f'backup_{now}.db'
-    shutil.copyfile(DB_PATH, backup_name)
-    flash(f'Backup criado: {backup_name}', 'success')
+    """Inicia um backup online em segundo plano sem bloquear o worker"""
+    if backups is None:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'erro': 'backup disponível apenas com SQLite'}), 501
+        flash('Backups do PostgreSQL são feitos no servidor da base (pg_dump)', 'info')
+        return redirect(url_for('dashboard'))
+    iniciado = backups.iniciar()
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'iniciado': iniciado, 'status_url': url_for('backup_status')}), 202
+    if iniciado:
+        flash('Backup iniciado em segundo plano', 'success')
+    else:
+        flash('Já existe um backup em andamento', 'info')
     return redirect(url_for('dashboard'))
 
+@app.route('/backup/status')
+@login_required
+def backup_status():
+    if backups is None:
+        return jsonify({'erro': 'backup disponível apenas com SQLite'}), 501
+    return jsonify(backups.status())
+
+def ultimos_concluidos(cur, limite):
+    """
+    Últimos atendimentos concluídos, nas tabelas vivas e nos arquivos mensais
+    Os meses são lidos do mais recente para trás e a leitura pára quando um mês
+    inteiro já é mais antigo do que os `limite` atendimentos encontrados.
+    """
+    encontrados = []
+    for mes in [None] + archive.meses(cur):
+        if mes and len(encontrados) >= limite and mes < encontrados[-1]['saida'][:7]:
+            break
+        atendimentos, clientes = 'atendimentos', 'clientes'
+        if mes:
+            atendimentos, clientes = archive.nome_arquivo(atendimentos, mes), archive.nome_arquivo(clientes, mes)
+        cur.execute(f'''
+            SELECT a.id, c.nome, c.telefone, s.nome as servico, a.entrada, a.saida, a.tempo_atendimento, a.valor_pago
+            FROM {atendimentos} a
+            JOIN {clientes} c ON c.id = a.cliente_id
+            LEFT JOIN servicos s ON s.id = a.servico_id
+            WHERE a.saida IS NOT NULL
+            ORDER BY a.saida DESC
+            LIMIT ?
+        ''', (limite,))
+        encontrados = sorted(encontrados + cur.fetchall(), key=lambda r: r['saida'], reverse=True)[:limite]
+    return encontrados
+
 @app.route('/report')
 @login_required
 def report():
     conn = get_conn()
     cur = conn.cursor()
     
-    # Atendimentos por dia (apenas finalizados), com receita do dia
+    # Atendimentos por dia (apenas finalizados), com receita do dia - lidos do resumo diário
     cur.execute(
         '''
-        SELECT date(saida) as dia, COUNT(*) as total, SUM(valor_pago) as receita
-        FROM atendimentos
-        WHERE saida IS NOT NULL
+        SELECT dia, SUM(total) as total, SUM(receita) as receita
+        FROM daily_rollup
         GROUP BY dia
         ORDER BY dia DESC
         LIMIT 30
@@ -366,40 +734,27 @@ def report():
     media_diaria = total_atendimentos / len(rows) if rows else 0
     
     cur.execute('''
-        SELECT SUM(valor_pago) as receita_total, COUNT(*) as concluidos
-        FROM atendimentos
-        WHERE saida IS NOT NULL
+        SELECT SUM(receita) as receita_total, SUM(total) as concluidos
+        FROM daily_rollup
     ''')
     agg = cur.fetchone()
     receita_total = float(agg['receita_total']) if agg and agg['receita_total'] is not None else 0.0
     concluidos = int(agg['concluidos']) if agg and agg['concluidos'] is not None else 0
     ticket_medio = (receita_total / concluidos) if concluidos else 0.0
     
-    # Últimos atendimentos concluídos
-    cur.execute('''
-        SELECT a.id, c.nome, c.telefone, s.nome as servico, a.entrada, a.saida, a.tempo_atendimento, a.valor_pago
-        FROM atendimentos a
-        JOIN clientes c ON c.id = a.cliente_id
-        LEFT JOIN servicos s ON s.id = a.servico_id
-        WHERE a.saida IS NOT NULL
-        ORDER BY a.saida DESC
-        LIMIT 50
-    ''')
-    recentes = cur.fetchall()
+    recentes = ultimos_concluidos(cur, 50)
     
     # Serviços mais populares
     cur.execute('''
-        SELECT COALESCE(s.nome, 'Serviço') as nome, COUNT(*) as usos
-        FROM atendimentos a
-        LEFT JOIN servicos s ON s.id = a.servico_id
-        WHERE a.saida IS NOT NULL
+        SELECT COALESCE(s.nome, 'Serviço') as nome, SUM(r.total) as usos
+        FROM daily_rollup r
+        LEFT JOIN servicos s ON s.id = r.servico_id
         GROUP BY s.nome
         ORDER BY usos DESC
         LIMIT 3
     ''')
     populares = cur.fetchall()
     
-    conn.close()
     return render_template(
         'report.html',
         rows=rows,
@@ -411,6 +766,16 @@ def report():
         populares=populares,
     )
 
+@app.route('/report/heatmap')
+@login_required
+def report_heatmap():
+    """Chegadas, espera média, atendimentos e receita por dia da semana e hora (?dias=365)"""
+    dias = min(max(request.args.get('dias', heatmap.HEATMAP_DAYS, type=int), 1), 3660)
+    sincronizar()
+    chave = (dias, observador.conhecidas.get('atendimentos'))
+    mapa = mapas_calor.get_or_set(chave, lambda: heatmap.calcular(get_conn(), dias))
+    return jsonify(mapa)
+
 @app.route('/auto-registro', methods=['GET', 'POST'])
 def auto_registro():
     """Página pública para clientes se registrarem na fila"""
@@ -418,7 +783,6 @@ def auto_registro():
     cur = conn.cursor()
     cur.execute('SELECT id, nome, preco, duracao_estimada, descricao FROM servicos ORDER BY nome')
     servicos = cur.fetchall()
-    conn.close()
     
     if request.method == 'POST':
         nome = request.form.get('nome')
@@ -429,28 +793,43 @@ def auto_registro():
             flash('Nome e serviço são obrigatórios!', 'danger')
             return redirect(url_for('auto_registro'))
         
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute('INSERT INTO clientes (nome, telefone, servico_id) VALUES (?,?,?)',
-                    (nome, telefone, servico))
+        identidade = customers.identificar(cur, nome, telefone)
+        cur.execute('INSERT INTO clientes (nome, telefone, servico_id, identidade_id) VALUES (?,?,?,?) RETURNING id',
+                    (nome, telefone, servico, identidade))
+        cliente_id = cur.fetchone()[0]
         conn.commit()
-        conn.close()
+        enqueue_cliente(cur, cliente_id)
+        fila_alterada()
         
-        flash('Você foi adicionado à fila! Aguarde ser chamado.', 'success')
-        return redirect(url_for('painel_publico'))
+        espera_min = minutos(agendador.previsao(cliente_id))
+        if espera_min is not None:
+            flash(f'Você foi adicionado à fila! Espera estimada: {espera_min} min.', 'success')
+        else:
+            flash('Você foi adicionado à fila! Aguarde ser chamado.', 'success')
+        return redirect(url_for('painel_publico', cliente=cliente_id))
     
-    return render_template('auto_registro.html', servicos=servicos)
+    espera_prevista = minutos(get_agendador().previsao_nova_chegada())
+    return render_template('auto_registro.html', servicos=servicos, espera_prevista=espera_prevista)
 
 @app.route('/servicos')
 @login_required
 def list_servicos():
-    """Lista todos os serviços do salão"""
+    """Lista os serviços do salão, paginados por chave (nome, id)"""
+    cursor, limite, _ = page_args()
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute('SELECT * FROM servicos ORDER BY nome')
+    if cursor:
+        cur.execute('SELECT * FROM servicos WHERE (nome, id) > (?, ?) ORDER BY nome, id LIMIT ?',
+                    (cursor[0], cursor[1], limite + 1))
+    else:
+        cur.execute('SELECT * FROM servicos ORDER BY nome, id LIMIT ?', (limite + 1,))
     servicos = cur.fetchall()
-    conn.close()
-    return render_template('servicos.html', servicos=servicos)
+    proximo = None
+    if len(servicos) > limite:
+        servicos = servicos[:limite]
+        ultimo = servicos[-1]
+        proximo = url_for('list_servicos', limite=limite, cursor=encode_cursor(ultimo['nome'], ultimo['id']))
+    return render_template('servicos.html', servicos=servicos, proximo=proximo)
 
 @app.route('/servicos/add', methods=['GET', 'POST'])
 @login_required
@@ -467,7 +846,6 @@ def add_servico():
         cur.execute('INSERT INTO servicos (nome, descricao, preco, duracao_estimada) VALUES (?,?,?,?)',
                     (nome, descricao, preco, duracao))
         conn.commit()
-        conn.close()
         
         flash('Serviço adicionado com sucesso!', 'success')
         return redirect(url_for('list_servicos'))
@@ -490,14 +868,12 @@ def edit_servico(id):
         cur.execute('UPDATE servicos SET nome=?, descricao=?, preco=?, duracao_estimada=? WHERE id=?',
                     (nome, descricao, preco, duracao, id))
         conn.commit()
-        conn.close()
         
         flash('Serviço atualizado com sucesso!', 'success')
         return redirect(url_for('list_servicos'))
     
     cur.execute('SELECT * FROM servicos WHERE id = ?', (id,))
     servico = cur.fetchone()
-    conn.close()
     
     return render_template('edit_servico.html', servico=servico)
 
@@ -517,13 +893,13 @@ def atendimento_atual():
         ORDER BY a.chamada DESC
     ''')
     atendimentos = cur.fetchall()
-    conn.close()
     return render_template('atendimento_atual.html', atendimentos=atendimentos)
 
+# Tempo de arranque do worker (imports, pool, migrações), também exposto em /metrics
+startup_seconds = time.perf_counter() - _inicio_arranque
+logging.getLogger('app').info('Worker pronto em %.1f ms (esquema v%d)', startup_seconds * 1000, versao_esquema)
+
 if __name__ == '__main__':
-    if not os.path.exists(DB_PATH):
-        from init_db import init_db
-        init_db()
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', '5000'))
     debug = os.getenv('FLASK_DEBUG', '0') == '1'
@@ -0,0 +1,166 @@
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+from db import Database, colunas, dialeto
+import search
+
+# Clientes concluídos (e os seus atendimentos) saem das tabelas da fila para
+# tabelas mensais clientes_arquivo_AAAAMM / atendimentos_arquivo_AAAAMM.
+# As vistas clientes_todos / atendimentos_todos juntam tabelas vivas e arquivos.
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS arquivo_meses (
+        mes TEXT PRIMARY KEY,
+        clientes INTEGER NOT NULL DEFAULT 0,
+        atendimentos INTEGER NOT NULL DEFAULT 0,
+        atualizado_em TEXT
+    )
+'''
+
+TABELAS = ('clientes', 'atendimentos')
+ARCHIVE_DAYS = int(os.getenv('ARCHIVE_DAYS', '7'))
+FORMATO = '%Y-%m-%d %H:%M:%S'
+
+def nome_arquivo(tabela, mes):
+    """Tabela de arquivo de um mês 'AAAA-MM'"""
+    return f'{tabela}_arquivo_{mes.replace("-", "")}'
+
+def meses(cur):
+    """Meses arquivados, do mais recente para o mais antigo"""
+    cur.execute('SELECT mes FROM arquivo_meses ORDER BY mes DESC')
+    return [r[0] for r in cur.fetchall()]
+
+def tabelas(cur, tabela):
+    """Tabela viva seguida das tabelas de arquivo, do mês mais recente ao mais antigo"""
+    return [tabela] + [nome_arquivo(tabela, mes) for mes in meses(cur)]
+
+def totais_arquivados(cur):
+    """(clientes, atendimentos) já movidos para os arquivos"""
+    cur.execute('SELECT COALESCE(SUM(clientes), 0), COALESCE(SUM(atendimentos), 0) FROM arquivo_meses')
+    return tuple(cur.fetchone())
+
+def selecao(conn, nome, vivas):
+    """Lista de colunas para ler `nome` com as colunas `vivas` (as que faltam vêm a NULL)"""
+    existentes = set(colunas(conn, nome))
+    return ', '.join(c if c in existentes else f'NULL AS {c}' for c in vivas)
+
+def recriar_vistas(conn):
+    """
+    Vistas *_todos: UNION ALL da tabela viva com todos os arquivos
+    Colunas acrescentadas à tabela viva depois de um mês ser arquivado vêm a NULL.
+    """
+    cur = conn.cursor()
+    for tabela in TABELAS:
+        vivas = colunas(conn, tabela)
+        partes = ' UNION ALL '.join(f'SELECT {selecao(conn, nome, vivas)} FROM {nome}'
+                                    for nome in tabelas(cur, tabela))
+        conn.execute(f'DROP VIEW IF EXISTS {tabela}_todos')
+        conn.execute(f'CREATE VIEW {tabela}_todos AS {partes}')
+
+def _criar_mes(conn, mes):
+    for tabela in TABELAS:
+        nome = nome_arquivo(tabela, mes)
+        # Mesma estrutura da tabela viva, sem dados
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {nome} AS SELECT * FROM {tabela} WHERE 1 = 0')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{nome_arquivo("atendimentos", mes)}_saida '
+                 f'ON {nome_arquivo("atendimentos", mes)} (saida)')
+    conn.execute(search.indice_telefone(nome_arquivo('clientes', mes)))
+    if 'identidade_id' in colunas(conn, nome_arquivo('clientes', mes)):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{nome_arquivo("clientes", mes)}_identidade '
+                     f'ON {nome_arquivo("clientes", mes)} (identidade_id)')
+    conn.execute('INSERT OR IGNORE INTO arquivo_meses (mes) VALUES (?)', (mes,))
+    # Na mesma transação que o primeiro lote do mês: as vistas nunca deixam de
+    # fora linhas já apagadas das tabelas vivas
+    recriar_vistas(conn)
+
+def _colunas_comuns(conn, tabela, mes):
+    """Colunas da tabela viva que também existem no arquivo do mês"""
+    existentes = set(colunas(conn, nome_arquivo(tabela, mes)))
+    return ', '.join(c for c in colunas(conn, tabela) if c in existentes)
+
+def arquivar(conn, dias=ARCHIVE_DAYS, lote=1000, agora=None):
+    """
+    Move para os arquivos mensais os clientes concluídos cujo último
+    atendimento terminou há mais de `dias` dias, com os seus atendimentos.
+    Cada lote é uma transação curta, para não bloquear a fila.
+    Retorna (clientes, atendimentos) movidos.
+    """
+    conn.execute(SCHEMA)
+    # Repara as vistas de uma execução antiga interrompida depois de criar um mês
+    recriar_vistas(conn)
+    conn.commit()
+    limite = ((agora or datetime.now()) - timedelta(days=dias)).strftime(FORMATO)
+    cur = conn.cursor()
+    movidos_clientes = movidos_atendimentos = 0
+    ultimo_id = 0
+    while True:
+        conhecidos = set(meses(cur))
+        if dialeto(conn) == 'sqlite':
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Percorre os clientes por id (keyset), sem reagrupar a tabela a cada lote
+            cur.execute('''
+                SELECT c.id, substr(MAX(a.saida), 1, 7) as mes
+                FROM clientes c
+                JOIN atendimentos a ON a.cliente_id = c.id
+                WHERE c.status = 'concluido' AND c.id > ?
+                GROUP BY c.id
+                HAVING COUNT(a.saida) = COUNT(*) AND MAX(a.saida) < ?
+                ORDER BY c.id
+                LIMIT ?
+            ''', (ultimo_id, limite, lote))
+            por_mes = {}
+            for row in cur.fetchall():
+                por_mes.setdefault(row['mes'], []).append(row['id'])
+                ultimo_id = row['id']
+            if not por_mes:
+                conn.rollback()
+                break
+            for mes, ids in por_mes.items():
+                if mes not in conhecidos:
+                    _criar_mes(conn, mes)
+                marcadores = ', '.join('?' * len(ids))
+                lista = _colunas_comuns(conn, 'atendimentos', mes)
+                cur.execute(f'''
+                    INSERT INTO {nome_arquivo("atendimentos", mes)} ({lista})
+                    SELECT {lista} FROM atendimentos WHERE cliente_id IN ({marcadores})
+                ''', ids)
+                cur.execute(f'DELETE FROM atendimentos WHERE cliente_id IN ({marcadores})', ids)
+                atendimentos = cur.rowcount
+                lista = _colunas_comuns(conn, 'clientes', mes)
+                cur.execute(f'''
+                    INSERT INTO {nome_arquivo("clientes", mes)} ({lista})
+                    SELECT {lista} FROM clientes WHERE id IN ({marcadores})
+                ''', ids)
+                cur.execute(f'DELETE FROM clientes WHERE id IN ({marcadores})', ids)
+                clientes = cur.rowcount
+                search.indexar(conn, nome_arquivo('clientes', mes), ids)
+                cur.execute('''
+                    UPDATE arquivo_meses
+                    SET clientes = clientes + ?, atendimentos = atendimentos + ?, atualizado_em = ?
+                    WHERE mes = ?
+                ''', (clientes, atendimentos, datetime.now().strftime(FORMATO), mes))
+                movidos_clientes += clientes
+                movidos_atendimentos += atendimentos
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return movidos_clientes, movidos_atendimentos
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Arquiva clientes concluídos e os seus atendimentos por mês')
+    parser.add_argument('--db', help='ficheiro SQLite (por omissão, DATABASE_URL ou DB_PATH)')
+    parser.add_argument('--dias', type=int, default=ARCHIVE_DAYS, help='idade mínima do último atendimento')
+    parser.add_argument('--lote', type=int, default=1000, help='clientes por transação')
+    args = parser.parse_args()
+    database = Database(f'sqlite:///{args.db}', size=1) if args.db else Database.from_env(size=1)
+    conn = database.acquire()
+    inicio = time.perf_counter()
+    try:
+        clientes, atendimentos = arquivar(conn, dias=args.dias, lote=args.lote)
+    finally:
+        database.release(conn)
+        database.close_all()
+    print(f'{clientes} clientes e {atendimentos} atendimentos arquivados em {time.perf_counter() - inicio:.2f}s')
@@ -0,0 +1,120 @@
+import argparse
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+class BackupManager:
+    """
+    Cópias de segurança online da base SQLite
+    Usa a API de backup do SQLite (cópia consistente, página a página) numa
+    thread em segundo plano, comprime opcionalmente com gzip e mantém apenas
+    as N cópias mais recentes.
+    """
+    def __init__(self, db_path, destino='backups', retencao=7, comprimir=True, paginas=1024, pausa=0.005):
+        self.db_path = db_path
+        self.destino = destino
+        self.retencao = retencao
+        self.comprimir = comprimir
+        self.paginas = paginas
+        self.pausa = pausa
+        self._lock = threading.Lock()
+        self._thread = None
+        self._estado = {'status': 'idle', 'arquivo': None, 'erro': None,
+                        'inicio': None, 'fim': None, 'progresso': None}
+
+    def iniciar(self):
+        """Inicia um backup em segundo plano; retorna False se já houver um a correr"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._executar_seguro, name='backup', daemon=True)
+            self._thread.start()
+            return True
+
+    def agendar(self, intervalo):
+        """Executa um backup a cada `intervalo` segundos numa thread daemon"""
+        def ciclo():
+            while True:
+                time.sleep(intervalo)
+                self.iniciar()
+        threading.Thread(target=ciclo, name='backup-agendado', daemon=True).start()
+
+    def status(self):
+        """Estado do último backup deste processo e cópias existentes no disco"""
+        with self._lock:
+            estado = dict(self._estado)
+        estado['backups'] = [os.path.basename(p) for p in self._existentes()]
+        return estado
+
+    def executar(self):
+        """Faz o backup de forma síncrona e retorna o caminho do ficheiro criado"""
+        os.makedirs(self.destino, exist_ok=True)
+        nome = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+        caminho = os.path.join(self.destino, nome)
+        temporario = caminho + '.tmp'
+
+        origem = sqlite3.connect(self.db_path)
+        copia = sqlite3.connect(temporario)
+        try:
+            # Cópia incremental: entre passos o SQLite liberta o ficheiro para os escritores
+            origem.backup(copia, pages=self.paginas, progress=self._progresso)
+        finally:
+            copia.close()
+            origem.close()
+
+        if self.comprimir:
+            caminho += '.gz'
+            with open(temporario, 'rb') as f_in, gzip.open(caminho, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(temporario)
+        else:
+            os.replace(temporario, caminho)
+
+        self._rotacionar()
+        return caminho
+
+    def _executar_seguro(self):
+        self._atualizar(status='running', arquivo=None, erro=None,
+                        inicio=datetime.now().isoformat(timespec='seconds'), fim=None, progresso=0.0)
+        try:
+            caminho = self.executar()
+            self._atualizar(status='ok', arquivo=os.path.basename(caminho))
+        except Exception as e:
+            self._atualizar(status='error', erro=str(e))
+        finally:
+            self._atualizar(fim=datetime.now().isoformat(timespec='seconds'))
+
+    def _progresso(self, status, restantes, total):
+        if total:
+            self._atualizar(progresso=round((total - restantes) / total, 3))
+        if self.pausa:
+            time.sleep(self.pausa)
+
+    def _atualizar(self, **campos):
+        with self._lock:
+            self._estado.update(campos)
+
+    def _existentes(self):
+        padrao = os.path.join(self.destino, 'backup_*.db*')
+        return sorted(p for p in glob.glob(padrao) if not p.endswith('.tmp'))
+
+    def _rotacionar(self):
+        """Apaga as cópias mais antigas além da política de retenção"""
+        existentes = self._existentes()
+        for antigo in existentes[:max(len(existentes) - self.retencao, 0)]:
+            os.remove(antigo)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backup online da base de dados')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'clientes_hair_salon.db'))
+    parser.add_argument('--destino', default=os.getenv('BACKUP_DIR', 'backups'))
+    parser.add_argument('--retencao', type=int, default=int(os.getenv('BACKUP_RETENCAO', '7')))
+    parser.add_argument('--sem-gzip', action='store_true')
+    args = parser.parse_args()
+    manager = BackupManager(args.db, args.destino, args.retencao, comprimir=not args.sem_gzip)
+    print(f'Backup criado: {manager.executar()}')
@@ -0,0 +1,398 @@
+"""
+Micro-benchmarks e teste de carga dos caminhos quentes da fila
+
+Gera um salão sintético numa base SQLite temporária, mede as operações das
+estruturas de dados (tempo e memória por cliente) e depois exercita as rotas
+Flask com o test client em concorrência crescente. Um teste de stress com vários processos a chamar o
+próximo cliente ao mesmo tempo verifica que ninguém é chamado duas vezes.
+O resultado sai em JSON para comparar entre commits:
+
+    python bench.py --clientes 20000 --espera 500 --dias 365 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import init_db
+from db import Database
+import stats
+from connection_pool import ConnectionPool
+from data_structures import LinkedList, FIFOSort, FilaEspera
+from queue_ops import claim_next
+import search
+import heatmap
+
+FORMATO = '%Y-%m-%d %H:%M:%S'
+
+def percentis(amostras):
+    """p50/p90/p99 e média (em milissegundos) de uma lista de durações em segundos"""
+    if not amostras:
+        return {}
+    ordenadas = sorted(amostras)
+    def p(q):
+        return ordenadas[min(int(q * len(ordenadas)), len(ordenadas) - 1)] * 1000
+    return {
+        'n': len(ordenadas),
+        'mean_ms': statistics.fmean(ordenadas) * 1000,
+        'p50_ms': p(0.50),
+        'p90_ms': p(0.90),
+        'p99_ms': p(0.99),
+        'max_ms': ordenadas[-1] * 1000,
+    }
+
+def cronometrar(func, repeticoes=5):
+    """Executa func várias vezes e retorna os percentis das durações"""
+    amostras = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        func()
+        amostras.append(time.perf_counter() - inicio)
+    return percentis(amostras)
+
+def gerar_salao(db_path, clientes, espera, dias, seed=42):
+    """
+    Cria uma base com `clientes` registados ao longo de `dias` dias, dos quais
+    os `espera` mais recentes ainda aguardam e os restantes já foram atendidos
+    """
+    rnd = random.Random(seed)
+    database = Database(f'sqlite:///{db_path}', size=1)
+    init_db.init_db(database)
+    database.close_all()
+    conn = sqlite3.connect(db_path)
+    servicos = [r[0] for r in conn.execute('SELECT id FROM servicos')]
+    agora = datetime.now().replace(microsecond=0)
+    inicio = agora - timedelta(days=dias)
+    passo = (agora - inicio) / max(clientes, 1)
+
+    linhas_clientes = []
+    linhas_atendimentos = []
+    for i in range(clientes):
+        chegada = inicio + passo * i
+        servico = rnd.choice(servicos)
+        aguarda = i >= clientes - espera
+        linhas_clientes.append((i + 1, f'Cliente {i + 1}', f'+2588{rnd.randrange(10**7):07d}', servico,
+                                chegada.strftime(FORMATO), 'espera' if aguarda else 'concluido'))
+        if not aguarda:
+            chamada = chegada + timedelta(seconds=rnd.randrange(60, 3600))
+            duracao = rnd.randrange(600, 7200)
+            saida = chamada + timedelta(seconds=duracao)
+            linhas_atendimentos.append((i + 1, servico, chegada.strftime(FORMATO), chamada.strftime(FORMATO),
+                                        saida.strftime(FORMATO), duracao, float(rnd.choice((100, 150, 200, 300)))))
+
+    with conn:
+        conn.executemany('INSERT INTO clientes (id, nome, telefone, servico_id, created_at, status) VALUES (?,?,?,?,?,?)',
+                         linhas_clientes)
+        conn.executemany('''
+            INSERT INTO atendimentos (cliente_id, servico_id, entrada, chamada, saida, tempo_atendimento, valor_pago)
+            VALUES (?,?,?,?,?,?,?)
+        ''', linhas_atendimentos)
+        stats.recalcular(conn)
+        stats.recalcular_rollup(conn)
+    conn.close()
+
+def medir_memoria(construir):
+    """Bytes alocados (e ainda vivos) por construir(); retorna (objeto, bytes)"""
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    objeto = construir()
+    usados = tracemalloc.get_traced_memory()[0] - antes
+    tracemalloc.stop()
+    return objeto, usados
+
+def bench_memoria(n, repeticoes):
+    """
+    Memória por cliente e tempo para materializar uma fila de `n` clientes
+    As linhas de origem já existem antes da medição: conta-se só o custo das
+    estruturas (nós, índice) e das cópias/vistas devolvidas por get_all().
+    """
+    rnd = random.Random(7)
+    nomes = ['Ana', 'Maria', 'João', 'Carlos', 'Fátima', 'Paulo', 'Rosa', 'Zacarias']
+    inicio = datetime(2026, 1, 1)
+    rows = [
+        {'id': i, 'nome': rnd.choice(nomes) + f' {i % 500}', 'telefone': f'+2588{rnd.randrange(10**7):07d}',
+         'servico_id': i % 11 + 1, 'created_at': (inicio + timedelta(seconds=i)).strftime(FORMATO)}
+        for i in range(n)
+    ]
+
+    def carregar():
+        fila = FilaEspera()
+        fila.load(rows)
+        return fila
+
+    def lista_ordenada():
+        fila = LinkedList()
+        for r in reversed(rows):
+            fila.append(r['id'], r['nome'], r['telefone'], r['servico_id'], r['created_at'])
+        return FIFOSort.sort_linked_list(fila)
+
+    fila, bytes_fila = medir_memoria(carregar)
+    _, bytes_lista = medir_memoria(lista_ordenada)
+    _, bytes_get_all = medir_memoria(fila.get_all)
+    _, bytes_dicts = medir_memoria(lambda: [dict(node) for node in fila])
+    return {
+        'clients': n,
+        'fila_espera_bytes_per_client': bytes_fila / n,
+        'linked_list_sorted_bytes_per_client': bytes_lista / n,
+        'get_all_bytes_per_client': bytes_get_all / n,
+        'dict_copy_bytes_per_client': bytes_dicts / n,
+        'materialize_fila_espera': cronometrar(carregar, repeticoes),
+        'build_and_sort_linked_list': cronometrar(lista_ordenada, repeticoes),
+        'iterate': cronometrar(lambda: sum(1 for _ in fila), repeticoes),
+        'get_all': cronometrar(fila.get_all, repeticoes),
+    }
+
+def bench_arranque(db_path, repeticoes):
+    """
+    Arranque de um worker num processo novo: tempo total até `import app` terminar
+    e o tempo medido pela própria aplicação (imports, pool, verificação do esquema)
+    """
+    env = dict(os.environ, DB_PATH=db_path, DATABASE_URL=f'sqlite:///{db_path}', NOTIFY_DISPATCH='off')
+    codigo = f'import sys; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); import app; print(app.startup_seconds)'
+    total = []
+    aplicacao = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        saida = subprocess.run([sys.executable, '-c', codigo], env=env, capture_output=True, text=True, check=True)
+        total.append(time.perf_counter() - inicio)
+        aplicacao.append(float(saida.stdout.strip().splitlines()[-1]))
+    return {'process': percentis(total), 'app_reported': percentis(aplicacao)}
+
+def bench_estruturas(db_path, repeticoes):
+    """Mede a construção e as operações da fila sobre os clientes em espera"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute('''
+        SELECT id, nome, telefone, servico_id, created_at FROM clientes
+        WHERE status = 'espera' ORDER BY created_at, id
+    ''').fetchall()
+    embaralhadas = list(rows)
+    random.Random(1).shuffle(embaralhadas)
+
+    def build_fifo_queue():
+        fila = LinkedList()
+        for r in embaralhadas:
+            fila.append(r['id'], r['nome'], r['telefone'], r['servico_id'], r['created_at'])
+        return FIFOSort.sort_linked_list(fila)
+
+    fila_ll = build_fifo_queue()
+
+    def fila_espera_ciclo():
+        fila = FilaEspera()
+        fila.load(rows)
+        for r in rows[::2]:
+            fila.remove(r['id'])
+        while fila.dequeue():
+            pass
+
+    def media_legada():
+        deltas = []
+        for r in conn.execute('SELECT entrada, chamada FROM atendimentos WHERE entrada IS NOT NULL AND chamada IS NOT NULL'):
+            deltas.append((datetime.strptime(r['chamada'], FORMATO) - datetime.strptime(r['entrada'], FORMATO)).total_seconds())
+        return sum(deltas) / len(deltas) if deltas else None
+
+    resultado = {
+        'waiting': len(rows),
+        'build_fifo_queue': cronometrar(build_fifo_queue, repeticoes),
+        'fifo_sort': cronometrar(lambda: FIFOSort.sort_linked_list(fila_ll), repeticoes),
+        'fila_espera_load_remove_dequeue': cronometrar(fila_espera_ciclo, repeticoes),
+        'average_wait_legacy_loop': cronometrar(media_legada, repeticoes),
+        'average_wait_sql': cronometrar(lambda: stats.media_espera_sql(conn.cursor()), repeticoes),
+        'average_wait_aggregate': cronometrar(lambda: stats.media_espera(conn.cursor()), repeticoes),
+    }
+    conn.close()
+    return resultado
+
+def bench_pesquisa(db_path, repeticoes):
+    """Latência do typeahead de /clientes/search, tecla a tecla, por nome e por telefone"""
+    database = Database(f'sqlite:///{db_path}', size=1)
+    conn = database.acquire()
+    telefone = conn.execute('SELECT telefone FROM clientes ORDER BY id DESC LIMIT 1').fetchone()[0]
+    consultas = ['cl', 'clie', 'cliente', 'cliente 1', 'cliente 12']
+    consultas += [telefone[:n] for n in range(6, len(telefone) + 1, 2)]
+    resultado = {}
+    for texto in consultas:
+        search.pesquisar(conn, texto)
+        resultado[texto] = cronometrar(lambda: search.pesquisar(conn, texto), max(repeticoes, 20))
+    database.release(conn)
+    database.close_all()
+    return resultado
+
+def bench_heatmap(db_path, repeticoes):
+    """Cálculo do mapa de calor de /report/heatmap sobre todo o histórico gerado"""
+    database = Database(f'sqlite:///{db_path}', size=1)
+    conn = database.acquire()
+    linhas = heatmap.calcular(conn)['linhas']
+    resultado = dict(linhas, calcular=cronometrar(lambda: heatmap.calcular(conn), repeticoes))
+    database.release(conn)
+    database.close_all()
+    return resultado
+
+def carregar_app(db_path):
+    """Importa a aplicação apontando para a base sintética"""
+    os.environ['DB_PATH'] = db_path
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    return app_module.app
+
+def cliente_logado(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+def bench_rota(app, metodo, rota, concorrencia, pedidos):
+    """Dispara `pedidos` requisições por thread em `concorrencia` threads"""
+    latencias = []
+    erros = []
+    lock = threading.Lock()
+
+    def trabalhador(_):
+        client = cliente_logado(app)
+        locais = []
+        for _ in range(pedidos):
+            inicio = time.perf_counter()
+            resposta = client.open(rota, method=metodo)
+            locais.append(time.perf_counter() - inicio)
+            if resposta.status_code >= 500:
+                with lock:
+                    erros.append(resposta.status_code)
+        with lock:
+            latencias.extend(locais)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(trabalhador, range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+    resultado = percentis(latencias)
+    resultado.update({'concurrency': concorrencia, 'errors': len(erros),
+                      'throughput_rps': len(latencias) / duracao if duracao else 0.0})
+    return resultado
+
+ROTAS = (
+    ('GET', '/painel-next'),
+    ('GET', '/'),
+    ('GET', '/dashboard'),
+    ('GET', '/report'),
+    ('POST', '/next'),
+)
+
+def bench_rotas(db_path, niveis, pedidos):
+    try:
+        app = carregar_app(db_path)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+    resultado = {}
+    for metodo, rota in ROTAS:
+        resultado[f'{metodo} {rota}'] = [bench_rota(app, metodo, rota, n, pedidos) for n in niveis]
+    return resultado
+
+def _stress_trabalhador(db_path):
+    conn = ConnectionPool(db_path, size=1).acquire()
+    chamados = []
+    latencias = []
+    while True:
+        inicio = time.perf_counter()
+        cliente = claim_next(conn)
+        latencias.append(time.perf_counter() - inicio)
+        if cliente is None:
+            break
+        chamados.append(cliente['id'])
+    conn.close()
+    return chamados, latencias
+
+def stress_next(pasta, processos, espera):
+    """
+    Vários processos esvaziam a mesma fila em paralelo com claim_next;
+    cada cliente deve ser chamado exatamente uma vez
+    """
+    db_path = os.path.join(pasta, 'stress.db')
+    gerar_salao(db_path, espera, espera, 1)
+    inicio = time.perf_counter()
+    with multiprocessing.Pool(processos) as pool:
+        resultados = pool.map(_stress_trabalhador, [db_path] * processos)
+    duracao = time.perf_counter() - inicio
+
+    chamados = [cid for ids, _ in resultados for cid in ids]
+    latencias = [lat for _, lats in resultados for lat in lats]
+    conn = sqlite3.connect(db_path)
+    duplicados_db = conn.execute('''
+        SELECT COUNT(*) FROM (SELECT cliente_id FROM atendimentos GROUP BY cliente_id HAVING COUNT(*) > 1)
+    ''').fetchone()[0]
+    restantes = conn.execute("SELECT COUNT(*) FROM clientes WHERE status = 'espera'").fetchone()[0]
+    conn.close()
+
+    resultado = percentis(latencias)
+    resultado.update({
+        'processes': processos,
+        'waiting': espera,
+        'claimed': len(chamados),
+        'double_calls': (len(chamados) - len(set(chamados))) + duplicados_db,
+        'left_waiting': restantes,
+        'per_process': [len(ids) for ids, _ in resultados],
+        'throughput_cps': len(chamados) / duracao if duracao else 0.0,
+    })
+    return resultado
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks dos caminhos quentes da fila')
+    parser.add_argument('--clientes', type=int, default=10000)
+    parser.add_argument('--espera', type=int, default=500)
+    parser.add_argument('--dias', type=int, default=90)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--concorrencia', default='1,2,4,8', help='níveis de concorrência separados por vírgula')
+    parser.add_argument('--pedidos', type=int, default=20, help='requisições por thread em cada nível')
+    parser.add_argument('--sem-rotas', action='store_true', help='não exercita as rotas Flask')
+    parser.add_argument('--memoria-clientes', type=int, default=10000, help='tamanho da fila no teste de memória')
+    parser.add_argument('--stress-processos', type=int, default=4, help='processos no stress de /next (0 desliga)')
+    parser.add_argument('--stress-espera', type=int, default=2000, help='clientes em espera no stress de /next')
+    parser.add_argument('--output', help='ficheiro JSON de saída (por omissão, stdout)')
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+
+    pasta = tempfile.mkdtemp(prefix='bench_salao_')
+    # Backups e ficheiros auxiliares ficam dentro da pasta temporária
+    os.chdir(pasta)
+    db_path = os.path.join(pasta, 'clientes_hair_salon.db')
+
+    inicio = time.perf_counter()
+    gerar_salao(db_path, args.clientes, args.espera, args.dias)
+    relatorio = {
+        'params': vars(args),
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'generate_seconds': time.perf_counter() - inicio,
+        'structures': bench_estruturas(db_path, args.repeticoes),
+        'memory': bench_memoria(args.memoria_clientes, args.repeticoes),
+        'startup': bench_arranque(db_path, args.repeticoes),
+        'search': bench_pesquisa(db_path, args.repeticoes),
+        'heatmap': bench_heatmap(db_path, args.repeticoes),
+    }
+    if not args.sem_rotas:
+        niveis = [int(n) for n in args.concorrencia.split(',') if n]
+        relatorio['routes'] = bench_rotas(db_path, niveis, args.pedidos)
+    if args.stress_processos:
+        relatorio['stress_next'] = stress_next(pasta, args.stress_processos, args.stress_espera)
+
+    saida = json.dumps(relatorio, indent=2, default=str)
+    if output:
+        with open(output, 'w') as f:
+            f.write(saida)
+    else:
+        print(saida)
+    if relatorio.get('stress_next', {}).get('double_calls'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+from db import Database
+import archive
+import changes
+import customers
+import stats
+
+# Tabelas transferíveis e as suas colunas, pela ordem usada no CSV
+TABELAS = {
+    'servicos': ('id', 'nome', 'descricao', 'preco', 'duracao_estimada'),
+    'clientes': ('id', 'nome', 'telefone', 'servico_id', 'created_at', 'status'),
+    'atendimentos': ('id', 'cliente_id', 'servico_id', 'entrada', 'chamada', 'saida',
+                     'tempo_atendimento', 'valor_pago'),
+}
+FORMATOS = ('csv', 'ndjson')
+LOTE = 1000
+
+def exportar(conn, tabela, formato='csv', lote=LOTE, progresso=None):
+    """
+    Gera a tabela em blocos de texto (CSV ou NDJSON), lendo `lote` linhas de
+    cada vez do cursor: a memória usada não depende do tamanho da tabela.
+    Se `progresso` for um dicionário, progresso['linhas'] conta as linhas geradas.
+    Clientes e atendimentos incluem os arquivos mensais (do mais antigo ao atual).
+    """
+    colunas = TABELAS[tabela]
+    cur = conn.cursor()
+    origens = [tabela]
+    if tabela in archive.TABELAS:
+        origens = archive.tabelas(cur, tabela)[::-1]
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer) if formato == 'csv' else None
+    if escritor:
+        escritor.writerow(colunas)
+    for rows in _ler_lotes(conn, cur, origens, colunas, lote):
+        for row in rows:
+            if escritor:
+                escritor.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(colunas, row)), ensure_ascii=False))
+                buffer.write('\n')
+        if progresso is not None:
+            progresso['linhas'] = progresso.get('linhas', 0) + len(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    resto = buffer.getvalue()
+    if resto:
+        yield resto
+
+def _ler_lotes(conn, cur, origens, colunas, lote):
+    for origem in origens:
+        cur.execute(f'SELECT {archive.selecao(conn, origem, colunas)} FROM {origem} ORDER BY id')
+        while True:
+            rows = cur.fetchmany(lote)
+            if not rows:
+                break
+            yield rows
+
+def ler_linhas(arquivo, formato):
+    """Itera um ficheiro CSV ou NDJSON como dicionários, uma linha de cada vez"""
+    if formato == 'csv':
+        for row in csv.DictReader(arquivo):
+            yield {k: (v if v != '' else None) for k, v in row.items()}
+    else:
+        for linha in arquivo:
+            if linha.strip():
+                yield json.loads(linha)
+
+def importar(conn, tabela, linhas, lote=5000):
+    """
+    Insere as linhas (dicionários) com executemany, uma transação por lote
+    Ids já existentes são ignorados. Retorna (lidas, inseridas, segundos).
+    """
+    permitidas = TABELAS[tabela]
+    inicio = time.perf_counter()
+    lidas = inseridas = 0
+    colunas = None
+    bloco = []
+
+    def gravar():
+        nonlocal inseridas
+        with conn:
+            cur = conn.cursor()
+            cur.executemany(
+                f'INSERT OR IGNORE INTO {tabela} ({", ".join(colunas)}) VALUES ({", ".join("?" * len(colunas))})',
+                bloco,
+            )
+            inseridas += max(cur.rowcount, 0)
+        bloco.clear()
+
+    for linha in linhas:
+        if colunas is None:
+            # Só colunas conhecidas entram no SQL
+            colunas = [c for c in permitidas if c in linha]
+            if not colunas:
+                raise ValueError(f'nenhuma coluna conhecida de {tabela} no ficheiro')
+        bloco.append(tuple(linha.get(c) for c in colunas))
+        lidas += 1
+        if len(bloco) >= lote:
+            gravar()
+    if bloco:
+        gravar()
+    return lidas, inseridas, time.perf_counter() - inicio
+
+def _formato(caminho, formato):
+    if formato:
+        return formato
+    return 'ndjson' if caminho.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exporta/importa clientes, atendimentos e serviços em CSV ou NDJSON')
+    parser.add_argument('--db', help='ficheiro SQLite (por omissão, DATABASE_URL ou DB_PATH)')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    exp = sub.add_parser('export', help='escreve a tabela no ficheiro (ou stdout)')
+    exp.add_argument('tabela', choices=TABELAS)
+    exp.add_argument('--formato', choices=FORMATOS)
+    exp.add_argument('--saida', help='ficheiro de saída (por omissão, stdout)')
+    imp = sub.add_parser('import', help='insere as linhas do ficheiro na tabela')
+    imp.add_argument('tabela', choices=TABELAS)
+    imp.add_argument('arquivo')
+    imp.add_argument('--formato', choices=FORMATOS)
+    imp.add_argument('--lote', type=int, default=5000, help='linhas por transação')
+    args = parser.parse_args()
+
+    database = Database(f'sqlite:///{args.db}', size=1) if args.db else Database.from_env(size=1)
+    conn = database.acquire()
+    try:
+        if args.comando == 'export':
+            formato = _formato(args.saida or '', args.formato)
+            saida = open(args.saida, 'w', newline='', encoding='utf-8') if args.saida else sys.stdout
+            inicio = time.perf_counter()
+            progresso = {'linhas': 0}
+            try:
+                for bloco in exportar(conn, args.tabela, formato, progresso=progresso):
+                    saida.write(bloco)
+            finally:
+                if args.saida:
+                    saida.close()
+            linhas = progresso['linhas']
+            segundos = time.perf_counter() - inicio
+            print(f'{linhas} linhas exportadas em {segundos:.2f}s ({linhas / max(segundos, 1e-9):.0f} linhas/s)',
+                  file=sys.stderr)
+        else:
+            formato = _formato(args.arquivo, args.formato)
+            with open(args.arquivo, newline='', encoding='utf-8') as arquivo:
+                lidas, inseridas, segundos = importar(conn, args.tabela, ler_linhas(arquivo, formato), args.lote)
+            if args.tabela == 'atendimentos' and inseridas:
+                # Os agregados passam a incluir o histórico importado
+                with conn:
+                    stats.recalcular(conn)
+                    stats.recalcular_rollup(conn)
+            if args.tabela == 'clientes' and inseridas:
+                # Visitas importadas com telefone passam a pertencer ao cliente habitual
+                customers.ligar_visitas(conn)
+            if args.tabela in ('clientes', 'atendimentos') and inseridas:
+                # Os workers em execução recarregam a fila e os contadores
+                changes.publicar(conn, 'fila' if args.tabela == 'clientes' else 'atendimentos')
+            print(f'{inseridas}/{lidas} linhas importadas em {segundos:.2f}s ({lidas / max(segundos, 1e-9):.0f} linhas/s)')
+    finally:
+        database.release(conn)
+        database.close_all()
@@ -0,0 +1,89 @@
+import threading
+
+from db import dialeto
+import metrics
+
+# Versões monotónicas do que está em memória nos workers. Quem escreve chama
+# publicar() com a chave do que mudou; cada worker compara as versões com as que
+# já viu e só recarrega as partes alteradas por outros processos.
+# 'fila': clientes em espera (entradas, edições, remoções, chamadas)
+# 'atendimentos': atendimentos finalizados (contadores e previsões)
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS versoes (
+        chave TEXT PRIMARY KEY,
+        versao INTEGER NOT NULL DEFAULT 0
+    )
+'''
+
+CHAVES = ('fila', 'atendimentos')
+
+def criar(conn):
+    conn.execute(SCHEMA)
+    conn.executemany('INSERT OR IGNORE INTO versoes (chave, versao) VALUES (?, 0)', [(c,) for c in CHAVES])
+
+def publicar(conn, chave):
+    """Avança a versão de `chave` (numa transação própria) e retorna a nova versão"""
+    if conn.in_transaction:
+        conn.commit()
+    row = conn.execute('UPDATE versoes SET versao = versao + 1 WHERE chave = ? RETURNING versao', (chave,)).fetchone()
+    conn.commit()
+    return row[0]
+
+def ler(conn):
+    """Versões atuais de todas as chaves"""
+    return {r[0]: r[1] for r in conn.execute('SELECT chave, versao FROM versoes').fetchall()}
+
+
+class Observador:
+    """
+    Deteta, por worker, as alterações feitas por outros processos
+    No SQLite verificar() custa um PRAGMA data_version, que só muda quando
+    outra conexão faz commit no ficheiro; a tabela de versões só é lida nesse
+    caso. No PostgreSQL lê sempre a tabela (uma linha por chave).
+    `ao_mudar(chaves)` é chamado com as chaves alteradas por outros.
+    """
+    def __init__(self, ao_mudar):
+        self.ao_mudar = ao_mudar
+        self.conhecidas = None
+        # data_version é por conexão: guarda o último valor visto em cada uma do pool
+        self._data_version = {}
+        self._lock = threading.Lock()
+
+    def verificar(self, conn):
+        """Retorna as chaves alteradas por outros processos desde a última verificação"""
+        if dialeto(conn) == 'sqlite':
+            atual = conn.execute('PRAGMA data_version').fetchone()[0]
+            if self._data_version.get(id(conn)) == atual and self.conhecidas is not None:
+                return set()
+            self._data_version[id(conn)] = atual
+        return self._comparar(ler(conn))
+
+    def publicar(self, conn, chave):
+        """Publica uma escrita deste worker sem a tratar como alteração externa"""
+        if self.conhecidas is None:
+            self.verificar(conn)
+        nova = publicar(conn, chave)
+        with self._lock:
+            anterior = self.conhecidas.get(chave, 0)
+            self.conhecidas[chave] = max(anterior, nova)
+        if nova != anterior + 1:
+            # Outro processo publicou entre a última verificação e esta escrita
+            self._notificar({chave})
+        return nova
+
+    def _comparar(self, versoes):
+        with self._lock:
+            if self.conhecidas is None:
+                self.conhecidas = versoes
+                return set()
+            alteradas = {c for c, v in versoes.items() if v > self.conhecidas.get(c, 0)}
+            for chave in alteradas:
+                self.conhecidas[chave] = versoes[chave]
+        if alteradas:
+            self._notificar(alteradas)
+        return alteradas
+
+    def _notificar(self, chaves):
+        for chave in chaves:
+            metrics.registry.inc('change_feed_reloads_total', {'chave': chave})
+        self.ao_mudar(chaves)
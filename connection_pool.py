@@ -0,0 +1,70 @@
+import os
+import queue
+import sqlite3
+import threading
+
+# Pragmas aplicados uma única vez a cada nova conexão
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))),
+    ('cache_size', int(os.getenv('DB_CACHE_SIZE', '-16000'))),
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', int(os.getenv('DB_BUSY_TIMEOUT', '5000'))),
+)
+
+class ConnectionPool:
+    """
+    Pool de conexões SQLite por processo (um por worker do gunicorn)
+    As conexões são criadas sob demanda, configuradas uma vez com os pragmas
+    e reutilizadas entre requisições em vez de abrir o ficheiro a cada rota.
+    """
+    def __init__(self, db_path, size=5, pragmas=DEFAULT_PRAGMAS, factory=sqlite3.Connection, cached_statements=128):
+        self.db_path = db_path
+        self.size = size
+        self.pragmas = pragmas
+        self.factory = factory
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=self.factory,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        """Retorna uma conexão livre do pool ou cria uma nova"""
+        # Após um fork (gunicorn --preload) as conexões herdadas não podem ser usadas
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Devolve a conexão ao pool, descartando transações pendentes"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        """Fecha todas as conexões livres do pool"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
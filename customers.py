@@ -0,0 +1,166 @@
+import argparse
+import time
+from datetime import datetime, timezone
+
+from db import Database, colunas, dialeto
+import archive
+import search
+
+# Identidade dos clientes habituais: uma linha por número de telefone
+# (normalizado), referida por clientes.identidade_id. Cada linha de clientes
+# continua a ser uma visita (entrada na fila); o histórico de um cliente são as
+# visitas com a mesma identidade, nas tabelas vivas e nos arquivos.
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS identidades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telefone_norm TEXT NOT NULL UNIQUE,
+        nome TEXT NOT NULL,
+        telefone TEXT NOT NULL,
+        primeira_visita TEXT NOT NULL,
+        ultima_visita TEXT NOT NULL
+    )
+'''
+
+# Nome e telefone ficam os da visita mais recente; as datas só alargam o intervalo
+UPSERT = '''
+    INSERT INTO identidades (telefone_norm, nome, telefone, primeira_visita, ultima_visita)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (telefone_norm) DO UPDATE SET
+        nome = CASE WHEN excluded.ultima_visita >= identidades.ultima_visita
+                    THEN excluded.nome ELSE identidades.nome END,
+        telefone = CASE WHEN excluded.ultima_visita >= identidades.ultima_visita
+                        THEN excluded.telefone ELSE identidades.telefone END,
+        primeira_visita = CASE WHEN excluded.primeira_visita < identidades.primeira_visita
+                               THEN excluded.primeira_visita ELSE identidades.primeira_visita END,
+        ultima_visita = CASE WHEN excluded.ultima_visita > identidades.ultima_visita
+                             THEN excluded.ultima_visita ELSE identidades.ultima_visita END
+'''
+
+FORMATO = '%Y-%m-%d %H:%M:%S'
+DIGITOS_NACIONAIS = 9
+
+def normalizar(telefone):
+    """
+    Chave da identidade: só os dígitos, sem o indicativo 258 quando o número
+    nacional vem completo ('+258 84 123 4567' e '841234567' são o mesmo cliente)
+    """
+    digitos = search.normalizar_telefone(telefone)
+    if len(digitos) == len(search.INDICATIVO) + DIGITOS_NACIONAIS and digitos.startswith(search.INDICATIVO):
+        digitos = digitos[len(search.INDICATIVO):]
+    return digitos or None
+
+def agora():
+    """Instante no formato de clientes.created_at (CURRENT_TIMESTAMP, em UTC)"""
+    return datetime.now(timezone.utc).strftime(FORMATO)
+
+def identificar(cur, nome, telefone, visita=None):
+    """
+    Cria ou atualiza (upsert) a identidade do telefone e retorna o seu id
+    Sem telefone utilizável retorna None: a visita fica anónima.
+    """
+    chave = normalizar(telefone)
+    if chave is None:
+        return None
+    visita = visita or agora()
+    cur.execute(UPSERT + ' RETURNING id', (chave, nome, telefone, visita, visita))
+    return cur.fetchone()[0]
+
+def historico(cur, identidade_id, limite=50):
+    """Visitas de um cliente (incluindo as arquivadas), da mais recente para a mais antiga"""
+    cur.execute('''
+        SELECT c.id, c.nome, c.created_at, c.status, s.nome as servico
+        FROM clientes_todos c
+        LEFT JOIN servicos s ON s.id = c.servico_id
+        WHERE c.identidade_id = ?
+        ORDER BY c.created_at DESC, c.id DESC
+        LIMIT ?
+    ''', (identidade_id, limite))
+    return cur.fetchall()
+
+# Visitas com telefone ainda sem identidade
+POR_LIGAR = "identidade_id IS NULL AND telefone IS NOT NULL AND telefone != ''"
+
+def preparar_tabela(conn, tabela):
+    """Coluna identidade_id e o seu índice numa tabela de clientes (viva ou de arquivo)"""
+    if 'identidade_id' not in colunas(conn, tabela):
+        conn.execute(f'ALTER TABLE {tabela} ADD COLUMN identidade_id INTEGER REFERENCES identidades (id)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabela}_identidade ON {tabela} (identidade_id)')
+
+def ligar_visitas(conn, lote=5000, progresso=None):
+    """
+    Liga às identidades as visitas antigas com telefone, juntando as repetidas
+    do mesmo número (tabela viva e arquivos). Cada lote é uma transação curta,
+    para correr com a aplicação em uso. As visitas por ligar são lidas pelo
+    índice de identidade_id (as NULL, por id), por isso uma execução
+    interrompida retoma onde ficou sem voltar a ler as já ligadas.
+    Retorna (visitas ligadas, identidades no fim).
+    """
+    cur = conn.cursor()
+    ligadas = 0
+    for tabela in archive.tabelas(cur, 'clientes'):
+        ultimo_id = 0
+        if conn.in_transaction:
+            conn.commit()
+        while True:
+            if dialeto(conn) == 'sqlite':
+                conn.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute(f'''
+                    SELECT id, nome, telefone, created_at FROM {tabela}
+                    WHERE id > ? AND {POR_LIGAR}
+                    ORDER BY id
+                    LIMIT ?
+                ''', (ultimo_id, lote))
+                rows = cur.fetchall()
+                if not rows:
+                    conn.rollback()
+                    break
+                ultimo_id = rows[-1]['id']
+                # Junta primeiro no lote, depois uma só escrita por número
+                grupos = {}
+                for r in rows:
+                    chave = normalizar(r['telefone'])
+                    if chave is None:
+                        continue
+                    g = grupos.setdefault(chave, {'ids': [], 'nome': r['nome'], 'telefone': r['telefone'],
+                                                  'primeira': r['created_at'], 'ultima': r['created_at']})
+                    g['ids'].append(r['id'])
+                    if r['created_at'] >= g['ultima']:
+                        g['nome'], g['telefone'], g['ultima'] = r['nome'], r['telefone'], r['created_at']
+                    g['primeira'] = min(g['primeira'], r['created_at'])
+                if grupos:
+                    cur.executemany(UPSERT, [(chave, g['nome'], g['telefone'], g['primeira'], g['ultima'])
+                                             for chave, g in grupos.items()])
+                    chaves = list(grupos)
+                    cur.execute(f'SELECT id, telefone_norm FROM identidades WHERE telefone_norm IN ({", ".join("?" * len(chaves))})',
+                                chaves)
+                    ids = {r['telefone_norm']: r['id'] for r in cur.fetchall()}
+                    pares = [(ids[chave], id_) for chave, g in grupos.items() for id_ in g['ids']]
+                    cur.executemany(f'UPDATE {tabela} SET identidade_id = ? WHERE id = ?', pares)
+                    ligadas += len(pares)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            if progresso is not None:
+                progresso(tabela, ultimo_id, ligadas)
+    cur.execute('SELECT COUNT(*) FROM identidades')
+    return ligadas, cur.fetchone()[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Liga as visitas antigas às identidades dos clientes (por telefone)')
+    parser.add_argument('--db', help='ficheiro SQLite (por omissão, DATABASE_URL ou DB_PATH)')
+    parser.add_argument('--lote', type=int, default=5000, help='visitas por transação')
+    args = parser.parse_args()
+    database = Database(f'sqlite:///{args.db}', size=1) if args.db else Database.from_env(size=1)
+    conn = database.acquire()
+    inicio = time.perf_counter()
+    try:
+        ligadas, identidades = ligar_visitas(
+            conn, lote=args.lote,
+            progresso=lambda tabela, ultimo_id, total: print(f'{tabela}: até id {ultimo_id}, {total} visitas ligadas'),
+        )
+    finally:
+        database.release(conn)
+        database.close_all()
+    print(f'{ligadas} visitas ligadas a {identidades} clientes em {time.perf_counter() - inicio:.2f}s')
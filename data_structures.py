@@ -1,14 +1,36 @@
+import sys
+import threading
+from operator import attrgetter
+
 class Node:
     """
     Nó da lista encadeada representando um cliente na fila do salão
+    Usa __slots__ (sem __dict__ por instância) e serve também de vista só de
+    leitura no estilo dicionário: node['nome'], dict(node).
     """
+    __slots__ = ('cliente_id', 'nome', 'telefone', 'servico_id', 'created_at', 'next', 'prev')
+    FIELDS = ('cliente_id', 'nome', 'telefone', 'servico_id', 'created_at')
+
     def __init__(self, cliente_id, nome, telefone, servico_id, created_at):
         self.cliente_id = cliente_id
-        self.nome = nome
+        # Nomes repetem-se muito (Ana, João...): uma só cópia de cada
+        self.nome = sys.intern(nome) if type(nome) is str else nome
         self.telefone = telefone
         self.servico_id = servico_id
         self.created_at = created_at
         self.next = None
+        self.prev = None
+
+    def __getitem__(self, campo):
+        if campo not in Node.FIELDS:
+            raise KeyError(campo)
+        return getattr(self, campo)
+
+    def keys(self):
+        return Node.FIELDS
+
+    def __repr__(self):
+        return f'Node({self.cliente_id!r}, {self.nome!r})'
 
 class LinkedList:
     """
@@ -17,25 +39,29 @@ class LinkedList:
     """
     def __init__(self):
         self.head = None
+        self.tail = None
+        self._size = 0
     
     def __len__(self):
-        count = 0
+        return self._size
+
+    def __iter__(self):
+        """Percorre os nós sem copiar nada"""
         current = self.head
         while current:
-            count += 1
+            yield current
             current = current.next
-        return count
 
     def append(self, cliente_id, nome, telefone, servico_id, created_at):
-        """Adiciona um cliente ao final da fila"""
+        """Adiciona um cliente ao final da fila - O(1)"""
         new_node = Node(cliente_id, nome, telefone, servico_id, created_at)
-        if not self.head:
+        if self.tail is None:
             self.head = new_node
-            return
-        last = self.head
-        while last.next:
-            last = last.next
-        last.next = new_node
+        else:
+            self.tail.next = new_node
+        self.tail = new_node
+        self._size += 1
+        return new_node
 
     def remove_head(self):
         """Remove e retorna o primeiro cliente da fila (FIFO)"""
@@ -43,22 +69,15 @@ class LinkedList:
             return None
         removed_node = self.head
         self.head = self.head.next
+        if self.head is None:
+            self.tail = None
+        removed_node.next = None
+        self._size -= 1
         return removed_node
     
     def get_all(self):
-        """Retorna todos os clientes da fila como lista"""
-        result = []
-        current = self.head
-        while current:
-            result.append({
-                'cliente_id': current.cliente_id,
-                'nome': current.nome,
-                'telefone': current.telefone,
-                'servico_id': current.servico_id,
-                'created_at': current.created_at
-            })
-            current = current.next
-        return result
+        """Retorna os nós da fila (vistas só de leitura: node['nome']), sem copiar em dicionários"""
+        return list(self)
 
 class FIFOSort:
     """
@@ -74,27 +93,129 @@ class FIFOSort:
         if not linked_list.head:
             return linked_list
 
-        # Converter para lista para ordenar por created_at
-        nodes = []
-        current = linked_list.head
-        while current:
-            nodes.append(current)
-            next_node = current.next
-            current.next = None
-            current = next_node
-        
-        # Ordenar por created_at (ordem crescente - mais antigo primeiro)
-        nodes.sort(key=lambda x: x.created_at)
-        
-        # Recriar a lista encadeada na ordem correta
-        sorted_list = LinkedList()
-        for node in nodes:
-            sorted_list.append(
-                node.cliente_id,
-                node.nome,
-                node.telefone,
-                node.servico_id,
-                node.created_at
-            )
+        # Ordenar referências aos nós (ordem crescente - mais antigo primeiro)
+        nodes = list(linked_list)
+        nodes.sort(key=attrgetter('created_at'))
         
-        return sorted_list
\ No newline at end of file
+        # Religar os mesmos nós na ordem correta, sem criar nós novos
+        for anterior, seguinte in zip(nodes, nodes[1:]):
+            anterior.next = seguinte
+        nodes[-1].next = None
+        linked_list.head = nodes[0]
+        linked_list.tail = nodes[-1]
+        return linked_list
+
+
+class FilaEspera:
+    """
+    Fila de espera persistente em memória (FIFO)
+    Mantém ponteiros para início e fim, contador de tamanho e um índice
+    cliente_id -> nó, de modo que entrar, sair, espreitar, remover por id
+    e len() são todos O(1). É carregada uma única vez a partir da base de
+    dados e depois atualizada incrementalmente pelas rotas.
+    """
+    def __init__(self):
+        self.head = None
+        self.tail = None
+        self._size = 0
+        self._index = {}
+        self._lock = threading.RLock()
+        self.carregada = False
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, cliente_id):
+        return cliente_id in self._index
+
+    def __iter__(self):
+        current = self.head
+        while current:
+            yield current
+            current = current.next
+
+    def load(self, rows):
+        """
+        Reconstrói a fila a partir de linhas já ordenadas por chegada
+        (created_at, id). Cada linha precisa de id, nome, telefone,
+        servico_id e created_at.
+        """
+        with self._lock:
+            self.clear()
+            for r in rows:
+                self.enqueue(r['id'], r['nome'], r['telefone'], r['servico_id'], r['created_at'])
+            self.carregada = True
+
+    def clear(self):
+        """Esvazia a fila"""
+        with self._lock:
+            self.head = None
+            self.tail = None
+            self._size = 0
+            self._index = {}
+
+    def enqueue(self, cliente_id, nome, telefone, servico_id, created_at):
+        """Adiciona um cliente ao final da fila - O(1)"""
+        with self._lock:
+            if cliente_id in self._index:
+                return self._index[cliente_id]
+            node = Node(cliente_id, nome, telefone, servico_id, created_at)
+            if self.tail is None:
+                self.head = node
+            else:
+                self.tail.next = node
+                node.prev = self.tail
+            self.tail = node
+            self._index[cliente_id] = node
+            self._size += 1
+            return node
+
+    def dequeue(self):
+        """Remove e retorna o primeiro cliente da fila - O(1)"""
+        with self._lock:
+            if self.head is None:
+                return None
+            return self._unlink(self.head)
+
+    def peek(self):
+        """Retorna o primeiro cliente sem o remover - O(1)"""
+        return self.head
+
+    def remove(self, cliente_id):
+        """Remove um cliente pelo id, em qualquer posição - O(1)"""
+        with self._lock:
+            node = self._index.get(cliente_id)
+            if node is None:
+                return None
+            return self._unlink(node)
+
+    def update(self, cliente_id, nome, telefone, servico_id):
+        """Atualiza os dados de um cliente mantendo a sua posição - O(1)"""
+        with self._lock:
+            node = self._index.get(cliente_id)
+            if node is None:
+                return None
+            node.nome = nome
+            node.telefone = telefone
+            node.servico_id = servico_id
+            return node
+
+    def get_all(self):
+        """Retorna os nós da fila (vistas só de leitura: node['nome']), sem copiar em dicionários"""
+        with self._lock:
+            return list(self)
+
+    def _unlink(self, node):
+        if node.prev is None:
+            self.head = node.next
+        else:
+            node.prev.next = node.next
+        if node.next is None:
+            self.tail = node.prev
+        else:
+            node.next.prev = node.prev
+        node.next = None
+        node.prev = None
+        del self._index[node.cliente_id]
+        self._size -= 1
+        return node
@@ -0,0 +1,156 @@
+import argparse
+import os
+import time
+
+from db import Database
+
+# Distribuição aprendida da duração de cada serviço (a partir de tempo_atendimento).
+# O histograma (contagens por minuto) permite juntar execuções incrementais e
+# recalcular mediana e p90 sem voltar a ler o histórico.
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS duracao_servico (
+        servico_id INTEGER PRIMARY KEY,
+        amostras INTEGER NOT NULL,
+        media REAL,
+        mediana REAL,
+        p90 REAL,
+        ewma REAL,
+        histograma BLOB NOT NULL
+    )
+'''
+
+SCHEMA_CHECKPOINT = '''
+    CREATE TABLE IF NOT EXISTS duracao_checkpoint (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        ultima_saida TEXT NOT NULL,
+        ultimo_id INTEGER NOT NULL
+    )
+'''
+
+# O NumPy só é importado quando o modelo é atualizado: este módulo também é
+# importado no arranque dos workers (pelo init_db) apenas pelos esquemas.
+BIN_SEGUNDOS = 60
+NUM_BINS = 8 * 60 + 1  # até 8 horas; o último bin acumula o excesso
+ALPHA = float(os.getenv('DURACAO_EWMA_ALPHA', '0.1'))
+
+def _carregar_novos(conn, desde):
+    """
+    Atendimentos finalizados depois do checkpoint, por ordem de saída, como
+    matriz NumPy (servico_id, tempo_atendimento), e o novo checkpoint
+    """
+    import numpy as np
+    cur = conn.cursor()
+    cur.row_factory = None
+    filtro = 'saida IS NOT NULL AND tempo_atendimento IS NOT NULL AND (saida, id) > (?, ?)'
+    cur.execute(f'SELECT saida, id FROM atendimentos_todos WHERE {filtro} ORDER BY saida DESC, id DESC LIMIT 1', desde)
+    ate = cur.fetchone()
+    if ate is None:
+        return None, None
+    # O limite superior fixa o conjunto lido mesmo que outros atendimentos terminem entretanto
+    cur.execute(f'''
+        SELECT COALESCE(servico_id, 0), tempo_atendimento
+        FROM atendimentos_todos
+        WHERE {filtro} AND (saida, id) <= (?, ?)
+        ORDER BY saida, id
+    ''', desde + tuple(ate))
+    return np.array(cur.fetchall(), dtype=np.float64), ate
+
+def _percentil(histograma, q):
+    """Percentil (em segundos) a partir das contagens por bin"""
+    import numpy as np
+    acumulado = np.cumsum(histograma)
+    if acumulado[-1] == 0:
+        return None
+    indice = int(np.searchsorted(acumulado, q * acumulado[-1]))
+    return (indice + 0.5) * BIN_SEGUNDOS
+
+def atualizar(conn, completo=False):
+    """
+    Processa os atendimentos novos desde a última execução e atualiza as
+    distribuições de duração; com completo=True recomeça do zero.
+    Retorna quantas linhas foram processadas.
+    """
+    import numpy as np
+    conn.execute(SCHEMA)
+    conn.execute(SCHEMA_CHECKPOINT)
+    if completo:
+        conn.execute('DELETE FROM duracao_servico')
+        conn.execute('DELETE FROM duracao_checkpoint')
+    checkpoint = conn.execute('SELECT ultima_saida, ultimo_id FROM duracao_checkpoint WHERE id = 1').fetchone()
+    desde = tuple(checkpoint) if checkpoint else ('', 0)
+
+    dados, ate = _carregar_novos(conn, desde)
+    if dados is None:
+        conn.commit()
+        return 0
+
+    servicos = dados[:, 0].astype(np.int64)
+    tempos = np.clip(dados[:, 1], 0, None)
+
+    # Agrupar por serviço mantendo a ordem de saída dentro de cada grupo
+    ids, grupo, contagens = np.unique(servicos, return_inverse=True, return_counts=True)
+    ordem = np.argsort(grupo, kind='stable')
+    grupo_ord = grupo[ordem]
+    tempos_ord = tempos[ordem]
+    inicio_grupo = np.concatenate(([0], np.cumsum(contagens)[:-1]))
+    fim_grupo = inicio_grupo + contagens - 1
+
+    # Histogramas: um bincount sobre (grupo, bin)
+    bins = np.minimum((tempos_ord // BIN_SEGUNDOS).astype(np.int64), NUM_BINS - 1)
+    hist = np.bincount(grupo_ord * NUM_BINS + bins, minlength=len(ids) * NUM_BINS).reshape(len(ids), NUM_BINS)
+    somas = np.bincount(grupo_ord, weights=tempos_ord, minlength=len(ids))
+
+    # EWMA fechada: e_n = (1-a)^n * e_0 + sum(a * (1-a)^(n-1-k) * x_k)
+    expoente = fim_grupo[grupo_ord] - np.arange(len(tempos_ord))
+    pesos = ALPHA * (1 - ALPHA) ** expoente
+    ewma_novos = np.bincount(grupo_ord, weights=pesos * tempos_ord, minlength=len(ids))
+    decaimento = (1 - ALPHA) ** contagens
+
+    anteriores = {
+        r[0]: r[1:] for r in conn.execute('SELECT servico_id, amostras, media, ewma, histograma FROM duracao_servico')
+    }
+    with conn:
+        for i, servico_id in enumerate(ids.tolist()):
+            amostras = int(contagens[i])
+            soma = float(somas[i])
+            histograma = hist[i]
+            anterior = anteriores.get(servico_id)
+            if anterior:
+                amostras_ant, media_ant, ewma_ant, hist_ant = anterior
+                histograma = histograma + np.frombuffer(hist_ant, dtype=np.int64)
+                soma += (media_ant or 0) * amostras_ant
+                amostras += amostras_ant
+                ewma = decaimento[i] * ewma_ant + ewma_novos[i]
+            else:
+                # Sem histórico, a primeira observação inicializa a média móvel
+                primeira = tempos_ord[inicio_grupo[i]]
+                ewma = decaimento[i] * primeira + ewma_novos[i]
+            conn.execute('''
+                INSERT INTO duracao_servico
+                    (servico_id, amostras, media, mediana, p90, ewma, histograma)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (servico_id) DO UPDATE SET
+                    amostras = excluded.amostras, media = excluded.media, mediana = excluded.mediana,
+                    p90 = excluded.p90, ewma = excluded.ewma, histograma = excluded.histograma
+            ''', (servico_id, amostras, soma / amostras, _percentil(histograma, 0.5),
+                  _percentil(histograma, 0.9), float(ewma), histograma.astype(np.int64).tobytes()))
+        conn.execute('''
+            INSERT INTO duracao_checkpoint (id, ultima_saida, ultimo_id) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET ultima_saida = excluded.ultima_saida, ultimo_id = excluded.ultimo_id
+        ''', tuple(ate))
+    return len(dados)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recalcula as durações aprendidas de cada serviço')
+    parser.add_argument('--db', help='ficheiro SQLite (por omissão, DATABASE_URL ou DB_PATH)')
+    parser.add_argument('--completo', action='store_true', help='ignora o checkpoint e reprocessa tudo')
+    args = parser.parse_args()
+    database = Database(f'sqlite:///{args.db}', size=1) if args.db else Database.from_env(size=1)
+    conn = database.acquire()
+    inicio = time.perf_counter()
+    try:
+        processadas = atualizar(conn, completo=args.completo)
+    finally:
+        database.release(conn)
+        database.close_all()
+    print(f'{processadas} atendimentos processados em {time.perf_counter() - inicio:.3f}s')
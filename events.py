@@ -0,0 +1,35 @@
+import threading
+
+class Broadcaster:
+    """
+    Canal de notificação dentro do processo para os streams SSE do painel
+    As rotas que alteram a fila chamam publish(); cada stream aberto espera
+    por uma nova versão (ou pelo timeout do keep-alive) sem consultar a base.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.versao = 0
+
+    def publish(self):
+        """Sinaliza que a fila mudou e acorda os streams em espera"""
+        with self._cond:
+            self.versao += 1
+            self._cond.notify_all()
+
+    def wait(self, versao, timeout):
+        """Bloqueia até a versão mudar ou o timeout expirar; retorna a versão atual"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.versao != versao, timeout)
+            return self.versao
+
+
+def format_sse(data, event=None, id_=None):
+    """Formata uma mensagem no protocolo Server-Sent Events"""
+    linhas = []
+    if id_ is not None:
+        linhas.append(f'id: {id_}')
+    if event is not None:
+        linhas.append(f'event: {event}')
+    for linha in data.splitlines() or ['']:
+        linhas.append(f'data: {linha}')
+    return '\n'.join(linhas) + '\n\n'
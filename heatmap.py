@@ -0,0 +1,176 @@
+import argparse
+import gc
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import Database
+
+# Procura por dia da semana × hora: chegadas (e chegadas por hora), espera média,
+# atendimentos finalizados e receita, mais os atendimentos de cada serviço por
+# hora. As colunas são lidas uma vez como arrays NumPy e agregadas com bincount
+# sobre o índice da célula (dia_semana * 24 + hora), sem ciclos por linha.
+# O NumPy só é importado no cálculo (o módulo é importado no arranque do app).
+DIAS_SEMANA = ('seg', 'ter', 'qua', 'qui', 'sex', 'sáb', 'dom')
+HORAS = 24
+CELULAS = len(DIAS_SEMANA) * HORAS
+HEATMAP_DAYS = int(os.getenv('HEATMAP_DAYS', '365'))
+# clientes.created_at vem do CURRENT_TIMESTAMP (UTC); chamada/saida estão na hora local.
+# HEATMAP_UTC_OFFSET (segundos) fixa o desvio; sem ele segue o fuso do processo, com a
+# hora de verão de cada instante.
+UTC_OFFSET = os.getenv('HEATMAP_UTC_OFFSET')
+FORMATO = '%Y-%m-%d %H:%M:%S'
+
+def _carregar(np, cur, sql, params, dtype):
+    """
+    Resultado da consulta como array estruturado (conversão feita pelo NumPy em C;
+    NULL vira NaT/nan). O GC fica parado durante a leitura: as centenas de
+    milhares de tuplos criados disparariam coletas sucessivas sem nada a libertar.
+    """
+    ativo = gc.isenabled()
+    gc.disable()
+    try:
+        cur.execute(sql, params)
+        linhas = cur.fetchall()
+        # Os arrays estruturados só aceitam tuplos (o psycopg2 devolve DictRow)
+        if linhas and not isinstance(linhas[0], tuple):
+            linhas = [tuple(r) for r in linhas]
+        return np.array(linhas, dtype=dtype)
+    finally:
+        if ativo:
+            gc.enable()
+
+def _hora_local(np, instantes):
+    """
+    Instantes UTC (datetime64[s]) passados à hora local. O desvio é calculado
+    uma vez por hora UTC distinta (as mudanças de hora são em horas certas).
+    """
+    if UTC_OFFSET is not None:
+        return instantes + np.timedelta64(int(UTC_OFFSET), 's')
+    horas, grupo = np.unique(instantes.astype('datetime64[h]'), return_inverse=True)
+    desvios = np.array([
+        datetime.fromtimestamp(int(h), timezone.utc).astimezone().utcoffset().total_seconds()
+        for h in horas.astype('datetime64[s]').astype(np.int64)
+    ], dtype=np.int64)
+    return instantes + desvios[grupo.reshape(-1)].astype('timedelta64[s]')
+
+def _celula(np, instantes):
+    """Índice dia_semana * 24 + hora (segunda = 0) de um array datetime64[s]"""
+    dias = instantes.astype('datetime64[D]')
+    horas = (instantes - dias).astype('timedelta64[h]').astype(np.int64)
+    # 1970-01-01 foi uma quinta-feira
+    return ((dias.astype(np.int64) + 3) % 7) * HORAS + horas
+
+def _lista(np, valores, casas=2):
+    """Matriz 7×24 como listas, com None onde não há dados"""
+    matriz = np.round(valores.reshape(len(DIAS_SEMANA), HORAS).astype(np.float64), casas)
+    return [[None if np.isnan(v) else v for v in linha] for linha in matriz.tolist()]
+
+def calcular(conn, dias=HEATMAP_DAYS, agora=None):
+    """Mapa de calor dos últimos `dias` dias (tabelas vivas e arquivos), pronto para JSON"""
+    import numpy as np
+    inicio = time.perf_counter()
+    agora = agora or datetime.now()
+    desde = (agora - timedelta(days=dias)).strftime(FORMATO)
+    cur = conn.cursor()
+    cur.row_factory = None
+
+    clientes = _carregar(np, cur, '''
+        SELECT id, created_at FROM clientes_todos WHERE created_at >= ?
+    ''', (desde,), [('id', 'i8'), ('chegada', 'M8[s]')])
+    atendimentos = _carregar(np, cur, '''
+        SELECT cliente_id, COALESCE(servico_id, 0), chamada, saida, valor_pago
+        FROM atendimentos_todos
+        WHERE chamada >= ?
+    ''', (desde,), [('cliente_id', 'i8'), ('servico', 'i8'), ('chamada', 'M8[s]'), ('saida', 'M8[s]'), ('valor', 'f8')])
+    cur.execute('SELECT id, nome FROM servicos')
+    nomes = dict(cur.fetchall())
+
+    # Ordenados por id para a junção com os atendimentos
+    ordem = np.argsort(clientes['id'], kind='stable')
+    ids = clientes['id'][ordem]
+    chegadas = _hora_local(np, clientes['chegada'][ordem])
+    cliente_ids = atendimentos['cliente_id']
+    servicos = atendimentos['servico']
+    chamadas = atendimentos['chamada']
+    saidas = atendimentos['saida']
+    valores = np.nan_to_num(atendimentos['valor'])
+
+    # Chegadas e taxa de chegada: média por hora em cada dia da semana do período
+    celula_chegada = _celula(np, chegadas)
+    total_chegadas = np.bincount(celula_chegada, minlength=CELULAS)
+    primeiro = np.datetime64(desde[:10], 'D')
+    dias_periodo = np.arange(primeiro, np.datetime64(agora.strftime('%Y-%m-%d'), 'D') + 1)
+    ocorrencias = np.bincount((dias_periodo.astype(np.int64) + 3) % 7, minlength=len(DIAS_SEMANA))
+    taxa = total_chegadas / np.repeat(np.maximum(ocorrencias, 1), HORAS)
+
+    # Espera (chegada -> chamada) agrupada pela hora de chegada: junção por cliente_id
+    # com searchsorted
+    posicao = np.minimum(np.searchsorted(ids, cliente_ids), max(len(ids) - 1, 0))
+    validos = ~np.isnat(chamadas)
+    if len(ids):
+        validos &= ids[posicao] == cliente_ids
+    else:
+        validos[:] = False
+    espera = (chamadas[validos] - chegadas[posicao[validos]]).astype(np.float64) / 60
+    celula_espera = celula_chegada[posicao[validos]]
+    esperas = np.bincount(celula_espera, minlength=CELULAS)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        espera_media = np.bincount(celula_espera, weights=np.maximum(espera, 0), minlength=CELULAS) / esperas
+
+    # Atendimentos finalizados e receita pela hora de saída
+    finalizados = ~np.isnat(saidas)
+    celula_saida = _celula(np, saidas[finalizados])
+    atendimentos = np.bincount(celula_saida, minlength=CELULAS)
+    receita = np.bincount(celula_saida, weights=valores[finalizados], minlength=CELULAS)
+
+    # Atendimentos por serviço e hora do dia
+    codigos, grupo = np.unique(servicos[finalizados], return_inverse=True)
+    por_servico = np.bincount(grupo * HORAS + celula_saida % HORAS,
+                              minlength=len(codigos) * HORAS).reshape(len(codigos), HORAS)
+
+    picos = np.argsort(-taxa, kind='stable')[:5]
+    return {
+        'desde': desde,
+        'dias': dias,
+        'dias_semana': list(DIAS_SEMANA),
+        'chegadas': total_chegadas.reshape(len(DIAS_SEMANA), HORAS).tolist(),
+        'chegadas_por_hora': _lista(np, taxa),
+        'espera_media_min': _lista(np, espera_media, 1),
+        'atendimentos': atendimentos.reshape(len(DIAS_SEMANA), HORAS).tolist(),
+        'receita': _lista(np, receita),
+        'servicos': {nomes.get(int(c), 'Serviço'): linha for c, linha in zip(codigos.tolist(), por_servico.tolist())},
+        'picos': [{'dia': DIAS_SEMANA[c // HORAS], 'hora': int(c % HORAS), 'chegadas_por_hora': round(float(taxa[c]), 2)}
+                  for c in picos.tolist() if taxa[c] > 0],
+        'linhas': {'clientes': int(len(ids)), 'atendimentos': int(len(cliente_ids))},
+        'segundos': round(time.perf_counter() - inicio, 4),
+    }
+
+def _texto(mapa):
+    """Tabela de chegadas por hora (linhas: dias da semana; colunas: horas com movimento)"""
+    horas = [h for h in range(HORAS) if any(linha[h] for linha in mapa['chegadas'])]
+    linhas = ['     ' + ''.join(f'{h:>6}' for h in horas)]
+    for dia, taxas in zip(mapa['dias_semana'], mapa['chegadas_por_hora']):
+        linhas.append(f'{dia:<5}' + ''.join(f'{taxas[h]:>6.1f}' for h in horas))
+    linhas.append('Picos: ' + ', '.join(f"{p['dia']} {p['hora']}h ({p['chegadas_por_hora']}/h)" for p in mapa['picos']))
+    return '\n'.join(linhas)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Chegadas, espera e receita por dia da semana e hora')
+    parser.add_argument('--db', help='ficheiro SQLite (por omissão, DATABASE_URL ou DB_PATH)')
+    parser.add_argument('--dias', type=int, default=HEATMAP_DAYS, help='período analisado')
+    parser.add_argument('--json', action='store_true', help='escreve o resultado completo em JSON')
+    args = parser.parse_args()
+    database = Database(f'sqlite:///{args.db}', size=1) if args.db else Database.from_env(size=1)
+    conn = database.acquire()
+    try:
+        mapa = calcular(conn, args.dias)
+    finally:
+        database.release(conn)
+        database.close_all()
+    if args.json:
+        print(json.dumps(mapa, ensure_ascii=False))
+    else:
+        print(_texto(mapa))
+        print(f"{mapa['linhas']['clientes']} clientes e {mapa['linhas']['atendimentos']} atendimentos em {mapa['segundos']:.3f}s")
@@ -1,94 +1,290 @@
-from flask import g
-import sqlite3
+import os
+import time
+from db import Database, dialeto, tabela_existe, colunas
+import stats
+import duration_model
+import archive
+import notifications
+import search
+import customers
+import changes
 
-DB_PATH = 'clientes_hair_salon.db'
+DB_PATH = os.getenv('DB_PATH', 'clientes_hair_salon.db')
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Chave do advisory lock do PostgreSQL que serializa as migrações
+LOCK_MIGRACOES = 7253101
 
-def init_db():
-    conn = get_conn()
-    with conn:
-        # Tabela de usuários (funcionários)
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                password TEXT NOT NULL,
-                role TEXT NOT NULL
-            )
-        ''')
-        
-        # Tabela de serviços do salão
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS servicos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                descricao TEXT,
-                preco REAL NOT NULL,
-                duracao_estimada INTEGER
-            )
-        ''')
-        
-        # Tabela de clientes
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS clientes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                telefone TEXT,
-                servico_id INTEGER,
-                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (servico_id) REFERENCES servicos (id)
-            )
-        ''')
-        
-        # Tabela de atendimentos
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS atendimentos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                cliente_id INTEGER NOT NULL,
-                servico_id INTEGER,
-                entrada TEXT NOT NULL,
-                chamada TEXT,
-                saida TEXT,
-                tempo_atendimento INTEGER,
-                valor_pago REAL,
-                FOREIGN KEY (cliente_id) REFERENCES clientes (id),
-                FOREIGN KEY (servico_id) REFERENCES servicos (id)
-            )
-        ''')
-        
-        # Inserir usuário padrão (admin/admin123)
+def init_db(database=None):
+    """
+    Aplica as migrações pendentes; sem `database` usa DATABASE_URL (ou o SQLite em DB_PATH)
+    Com o esquema em dia custa uma única leitura da versão.
+    Retorna (versão anterior, versão atual).
+    """
+    proprio = database is None
+    if proprio:
+        database = Database.from_env(DB_PATH, size=1)
+    conn = database.acquire()
+    try:
+        return migrar(conn)
+    finally:
+        database.release(conn)
+        if proprio:
+            database.close_all()
+
+def versao(conn):
+    """Versão do esquema: PRAGMA user_version no SQLite, tabela schema_version no PostgreSQL"""
+    if dialeto(conn) == 'postgresql':
+        if not tabela_existe(conn, 'schema_version'):
+            return 0
+        row = conn.execute('SELECT versao FROM schema_version').fetchone()
+        return row[0] if row else 0
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def _gravar_versao(conn, numero):
+    if dialeto(conn) == 'postgresql':
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version (versao INTEGER NOT NULL)')
+        conn.execute('DELETE FROM schema_version')
+        conn.execute('INSERT INTO schema_version (versao) VALUES (?)', (numero,))
+    else:
+        conn.execute(f'PRAGMA user_version = {int(numero)}')
+
+def migrar(conn):
+    """
+    Aplica, numa única transação e sob lock de escrita, os passos com número
+    acima da versão atual. Vários workers a arrancar ao mesmo tempo esperam pelo
+    lock e depois encontram a versão já atualizada.
+    """
+    atual = versao(conn)
+    if conn.in_transaction:
+        conn.commit()
+    if atual >= VERSAO_ATUAL:
+        return atual, atual
+    if dialeto(conn) == 'postgresql':
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (LOCK_MIGRACOES,))
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Reler sob o lock: outro processo pode ter migrado entretanto
+        inicial = versao(conn)
+        for numero, passo in MIGRACOES:
+            if numero > inicial:
+                passo(conn)
+        _gravar_versao(conn, VERSAO_ATUAL)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return inicial, VERSAO_ATUAL
+
+
+def _v1_tabelas_base(conn):
+    # Tabela de usuários (funcionários)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+    ''')
+
+    # Tabela de serviços do salão
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS servicos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            descricao TEXT,
+            preco REAL NOT NULL,
+            duracao_estimada INTEGER
+        )
+    ''')
+
+    # Tabela de clientes
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            telefone TEXT,
+            servico_id INTEGER,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'espera',
+            FOREIGN KEY (servico_id) REFERENCES servicos (id)
+        )
+    ''')
+
+    # Tabela de atendimentos
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS atendimentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cliente_id INTEGER NOT NULL,
+            servico_id INTEGER,
+            entrada TEXT NOT NULL,
+            chamada TEXT,
+            saida TEXT,
+            tempo_atendimento INTEGER,
+            valor_pago REAL,
+            FOREIGN KEY (cliente_id) REFERENCES clientes (id),
+            FOREIGN KEY (servico_id) REFERENCES servicos (id)
+        )
+    ''')
+
+    # Inserir usuário padrão (admin/admin123)
+    conn.execute('''
+        INSERT OR IGNORE INTO usuarios (username, password, role)
+        VALUES ('admin', 'admin123', 'admin')
+    ''')
+
+    # Serviços padrão do salão moçambicano, só numa base sem serviços
+    if conn.execute('SELECT 1 FROM servicos LIMIT 1').fetchone() is None:
+        conn.executemany('''
+            INSERT INTO servicos (nome, descricao, preco, duracao_estimada)
+            VALUES (?, ?, ?, ?)
+        ''', SERVICOS_PADRAO)
+
+def _v2_status_e_indices(conn):
+    # Estado materializado do cliente na fila: 'espera', 'atendimento' ou 'concluido'
+    if 'status' not in colunas(conn, 'clientes'):
+        conn.execute("ALTER TABLE clientes ADD COLUMN status TEXT NOT NULL DEFAULT 'espera'")
         conn.execute('''
-            INSERT OR IGNORE INTO usuarios (username, password, role)
-            VALUES ('admin', 'admin123', 'admin')
+            UPDATE clientes SET status = CASE
+                WHEN EXISTS (SELECT 1 FROM atendimentos a WHERE a.cliente_id = clientes.id AND a.saida IS NULL)
+                THEN 'atendimento' ELSE 'concluido' END
+            WHERE EXISTS (SELECT 1 FROM atendimentos a WHERE a.cliente_id = clientes.id)
         ''')
-        
-        # Inserir serviços padrão do salão moçambicano
-        servicos_padrao = [
-            ('Corte de Cabelo Masculino', 'Corte tradicional ou moderno', 150.00, 30),
-            ('Corte de Cabelo Feminino', 'Corte e acabamento', 200.00, 45),
-            ('Barba', 'Aparar e modelar barba', 100.00, 20),
-            ('Corte + Barba', 'Combo completo', 220.00, 45),
-            ('Tranças', 'Diversos estilos de tranças', 300.00, 90),
-            ('Penteado', 'Penteado para eventos', 250.00, 60),
-            ('Coloração', 'Tingir cabelo', 400.00, 90),
-            ('Alisamento', 'Tratamento alisante', 500.00, 120),
-            ('Hidratação', 'Tratamento capilar', 200.00, 45),
-            ('Manicure', 'Tratamento de unhas das mãos', 100.00, 30),
-            ('Pedicure', 'Tratamento de unhas dos pés', 150.00, 45)
-        ]
-        
-        for servico in servicos_padrao:
-            conn.execute('''
-                INSERT OR IGNORE INTO servicos (nome, descricao, preco, duracao_estimada)
-                VALUES (?, ?, ?, ?)
-            ''', servico)
-    
-    conn.close()
+
+    # Índices secundários
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_atendimentos_cliente ON atendimentos (cliente_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_atendimentos_saida ON atendimentos (saida)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_clientes_created_at ON clientes (created_at)')
+    # Índice parcial: só contém quem está à espera, por ordem de chegada
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_clientes_espera
+        ON clientes (created_at, id) WHERE status = 'espera'
+    ''')
+
+def _v3_arquivo(conn):
+    # Meses arquivados e vistas que juntam as tabelas vivas com os arquivos
+    conn.execute(archive.SCHEMA)
+    archive.recriar_vistas(conn)
+
+def _v4_agregados(conn):
+    # Agregados de tempo de espera/atendimento (preenchidos a partir do histórico na criação)
+    existe = tabela_existe(conn, 'estatisticas')
+    conn.execute(stats.SCHEMA)
+    if not existe:
+        stats.recalcular(conn)
+
+    existe = tabela_existe(conn, 'daily_rollup')
+    conn.execute(stats.SCHEMA_ROLLUP)
+    if not existe:
+        stats.recalcular_rollup(conn)
+
+    # Durações aprendidas por serviço (preenchidas por duration_model.py)
+    conn.execute(duration_model.SCHEMA)
+    conn.execute(duration_model.SCHEMA_CHECKPOINT)
+
+def _v5_notificacoes(conn):
+    # Outbox dos avisos de "está quase na sua vez"
+    conn.execute(notifications.SCHEMA)
+    conn.execute(notifications.SCHEMA_INDICE)
+
+def _v6_servicos_unicos(conn):
+    """
+    O antigo init_db voltava a inserir os serviços padrão a cada arranque:
+    junta os duplicados no serviço de menor id e torna o nome único
+    """
+    duplicados = conn.execute('''
+        SELECT s.id, m.manter
+        FROM servicos s
+        JOIN (SELECT nome, MIN(id) as manter FROM servicos GROUP BY nome HAVING COUNT(*) > 1) m
+          ON m.nome = s.nome AND s.id != m.manter
+    ''').fetchall()
+    if duplicados:
+        pares = [(manter, id_) for id_, manter in duplicados]
+        for tabela in archive.tabelas(conn.cursor(), 'clientes') + archive.tabelas(conn.cursor(), 'atendimentos'):
+            conn.executemany(f'UPDATE {tabela} SET servico_id = ? WHERE servico_id = ?', pares)
+        conn.executemany('DELETE FROM duracao_servico WHERE servico_id = ?', [(id_,) for _, id_ in pares])
+        conn.executemany('DELETE FROM servicos WHERE id = ?', [(id_,) for _, id_ in pares])
+        stats.recalcular_rollup(conn)
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_servicos_nome ON servicos (nome)')
+
+def _v7_pesquisa(conn):
+    # Pesquisa de clientes: FTS5 por nome e índice do telefone normalizado (também nos arquivos)
+    search.criar(conn)
+    for tabela in archive.tabelas(conn.cursor(), 'clientes')[1:]:
+        conn.execute(search.indice_telefone(tabela))
+
+def _v8_identidades(conn):
+    # Identidade dos clientes habituais; as visitas antigas são ligadas depois,
+    # em lotes, por customers.py (sem prender o lock das migrações)
+    conn.execute(customers.SCHEMA)
+    for tabela in archive.tabelas(conn.cursor(), 'clientes'):
+        customers.preparar_tabela(conn, tabela)
+    archive.recriar_vistas(conn)
+
+def _v9_versoes(conn):
+    # Versões da fila e dos atendimentos, para os workers detetarem escritas uns dos outros
+    changes.criar(conn)
+
+def _v10_entrada_chegada(conn):
+    """
+    atendimentos.entrada passou a ser a chegada à fila (clientes.created_at, na hora
+    local); antes era gravada igual à chamada. Corrige as linhas antigas (vivas e
+    arquivadas, cada mês com os seus clientes) e reconstrói os agregados de espera.
+    """
+    cur = conn.cursor()
+    for clientes, atendimentos in zip(archive.tabelas(cur, 'clientes'), archive.tabelas(cur, 'atendimentos')):
+        rows = conn.execute(f'''
+            SELECT a.id, c.created_at, a.chamada
+            FROM {atendimentos} a
+            JOIN {clientes} c ON c.id = a.cliente_id
+            WHERE a.entrada = a.chamada
+        ''').fetchall()
+        pares = []
+        for id_, created_at, chamada in rows:
+            entrada = stats.hora_local(created_at)
+            if entrada and entrada < chamada:
+                pares.append((entrada, id_))
+        conn.executemany(f'UPDATE {atendimentos} SET entrada = ? WHERE id = ?', pares)
+    stats.recalcular(conn)
+
+def _v11_pesquisa_palavras(conn):
+    # No PostgreSQL a pesquisa por nome passou a ser por palavra (tsvector), como o FTS5
+    if dialeto(conn) == 'postgresql':
+        conn.execute('DROP INDEX IF EXISTS idx_clientes_nome_lower')
+        conn.execute(search.INDICE_NOME_PG)
+
+# Passos do esquema por ordem; acrescentar sempre no fim com o número seguinte
+MIGRACOES = (
+    (1, _v1_tabelas_base),
+    (2, _v2_status_e_indices),
+    (3, _v3_arquivo),
+    (4, _v4_agregados),
+    (5, _v5_notificacoes),
+    (6, _v6_servicos_unicos),
+    (7, _v7_pesquisa),
+    (8, _v8_identidades),
+    (9, _v9_versoes),
+    (10, _v10_entrada_chegada),
+    (11, _v11_pesquisa_palavras),
+)
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+SERVICOS_PADRAO = [
+    ('Corte de Cabelo Masculino', 'Corte tradicional ou moderno', 150.00, 30),
+    ('Corte de Cabelo Feminino', 'Corte e acabamento', 200.00, 45),
+    ('Barba', 'Aparar e modelar barba', 100.00, 20),
+    ('Corte + Barba', 'Combo completo', 220.00, 45),
+    ('Tranças', 'Diversos estilos de tranças', 300.00, 90),
+    ('Penteado', 'Penteado para eventos', 250.00, 60),
+    ('Coloração', 'Tingir cabelo', 400.00, 90),
+    ('Alisamento', 'Tratamento alisante', 500.00, 120),
+    ('Hidratação', 'Tratamento capilar', 200.00, 45),
+    ('Manicure', 'Tratamento de unhas das mãos', 100.00, 30),
+    ('Pedicure', 'Tratamento de unhas dos pés', 150.00, 45)
+]
 
 if __name__ == '__main__':
-    init_db()
-    print('Base de dados inicializada com sucesso!')
\ No newline at end of file
+    inicio = time.perf_counter()
+    anterior, atual = init_db()
+    print(f'Base de dados na versão {atual} (antes: {anterior}) em {(time.perf_counter() - inicio) * 1000:.1f} ms')
@@ -0,0 +1,187 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('metrics')
+
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_MS', '100')) / 1000
+
+# Limites dos buckets (segundos / contagens), no estilo Prometheus
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+class Histogram:
+    """Histograma cumulativo com buckets fixos, soma e contagem"""
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.counts[i] += 1
+                break
+        self.total += valor
+        self.count += 1
+
+
+class Registry:
+    """
+    Métricas agregadas do processo, expostas em formato de texto Prometheus
+    Cada família é um dicionário de labels -> Histogram ou contador.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+
+    def observe(self, nome, labels, valor, buckets=LATENCY_BUCKETS):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            familia = self.histograms.setdefault(nome, {})
+            hist = familia.get(chave)
+            if hist is None:
+                hist = familia[chave] = Histogram(buckets)
+            hist.observe(valor)
+
+    def inc(self, nome, labels, valor=1):
+        chave = tuple(sorted(labels.items()))
+        with self._lock:
+            familia = self.counters.setdefault(nome, {})
+            familia[chave] = familia.get(chave, 0) + valor
+
+    def render(self, extras=()):
+        """Texto no formato de exposição Prometheus; `extras` são linhas (nome, labels, valor, tipo)"""
+        linhas = []
+        with self._lock:
+            for nome, familia in sorted(self.histograms.items()):
+                linhas.append(f'# TYPE {nome} histogram')
+                for chave, hist in sorted(familia.items()):
+                    acumulado = 0
+                    for limite, n in zip(hist.buckets, hist.counts):
+                        acumulado += n
+                        linhas.append(f'{nome}_bucket{_labels(chave, le=limite)} {acumulado}')
+                    linhas.append(f'{nome}_bucket{_labels(chave, le="+Inf")} {hist.count}')
+                    linhas.append(f'{nome}_sum{_labels(chave)} {hist.total}')
+                    linhas.append(f'{nome}_count{_labels(chave)} {hist.count}')
+            for nome, familia in sorted(self.counters.items()):
+                linhas.append(f'# TYPE {nome} counter')
+                for chave, valor in sorted(familia.items()):
+                    linhas.append(f'{nome}{_labels(chave)} {valor}')
+        tipos = set()
+        for nome, labels, valor, tipo in extras:
+            if nome not in tipos:
+                linhas.append(f'# TYPE {nome} {tipo}')
+                tipos.add(nome)
+            linhas.append(f'{nome}{_labels(tuple(sorted(labels.items())))} {valor}')
+        return '\n'.join(linhas) + '\n'
+
+def _labels(chave, **extra):
+    pares = list(chave) + list(extra.items())
+    if not pares:
+        return ''
+    texto = ','.join(f'{k}="{str(v)}"' for k, v in pares)
+    return '{' + texto + '}'
+
+
+registry = Registry()
+
+# Contadores de SQL da requisição em curso (um por thread)
+_atual = threading.local()
+
+def start_request():
+    _atual.queries = 0
+    _atual.rows = 0
+    _atual.sql_seconds = 0.0
+
+def finish_request(rota, metodo, status, duracao):
+    """Regista a latência da rota e o SQL emitido durante a requisição"""
+    labels = {'route': rota, 'method': metodo}
+    registry.observe('http_request_duration_seconds', dict(labels, status=status), duracao)
+    registry.observe('db_queries_per_request', labels, getattr(_atual, 'queries', 0), COUNT_BUCKETS)
+    registry.inc('db_rows_fetched_total', labels, getattr(_atual, 'rows', 0))
+    registry.inc('db_seconds_total', labels, getattr(_atual, 'sql_seconds', 0.0))
+    start_request()
+
+def _registar_sql(sql, duracao, linhas=0):
+    if hasattr(_atual, 'queries'):
+        _atual.sql_seconds += duracao
+        _atual.rows += linhas
+    if duracao >= SLOW_QUERY_SECONDS:
+        logger.warning('Consulta lenta (%.1f ms): %s', duracao * 1000, ' '.join(sql.split())[:300])
+
+def registar_instrucao(sql, duracao):
+    """Conta uma instrução executada (também usado pelos cursores do PostgreSQL em db.py)"""
+    if hasattr(_atual, 'queries'):
+        _atual.queries += 1
+    registry.observe('db_statement_duration_seconds', {'statement': _tipo(sql)}, duracao)
+    _registar_sql(sql, duracao)
+
+def registar_linhas(sql, duracao, linhas):
+    _registar_sql(sql, duracao, linhas)
+
+def _tipo(sql):
+    palavra = sql.lstrip().split(None, 1)
+    return palavra[0].upper() if palavra else ''
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que conta instruções, linhas lidas e tempo gasto no SQLite"""
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            registar_instrucao(sql, time.perf_counter() - inicio)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            registar_instrucao(sql, time.perf_counter() - inicio)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        row = super().fetchone()
+        _registar_sql(getattr(self, '_sql', ''), time.perf_counter() - inicio, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _registar_sql(getattr(self, '_sql', ''), time.perf_counter() - inicio, len(rows))
+        return rows
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        rows = super().fetchall()
+        _registar_sql(getattr(self, '_sql', ''), time.perf_counter() - inicio, len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        if hasattr(_atual, 'rows'):
+            _atual.rows += 1
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Conexão cujos cursores (inclusive os de conn.execute) são instrumentados"""
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,319 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+from db import Database, dialeto
+import metrics
+
+logger = logging.getLogger('notifications')
+
+# Outbox persistente: /next só insere linhas aqui; o envio é feito por um
+# Despachante numa thread (ou num processo à parte com `python notifications.py`).
+# UNIQUE (cliente_id, tipo) garante um único aviso por cliente.
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS notificacoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cliente_id INTEGER NOT NULL,
+        tipo TEXT NOT NULL,
+        telefone TEXT NOT NULL,
+        nome TEXT,
+        status TEXT NOT NULL DEFAULT 'pendente',
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        proxima_tentativa TEXT NOT NULL,
+        reservada_em TEXT,
+        enviada_em TEXT,
+        erro TEXT,
+        UNIQUE (cliente_id, tipo)
+    )
+'''
+SCHEMA_INDICE = '''
+    CREATE INDEX IF NOT EXISTS idx_notificacoes_pendentes
+    ON notificacoes (status, proxima_tentativa)
+'''
+
+FORMATO = '%Y-%m-%d %H:%M:%S'
+NOTIFY_AHEAD = int(os.getenv('NOTIFY_AHEAD', '3'))
+MENSAGEM = os.getenv('NOTIFY_MESSAGE', 'Olá {nome}, a sua vez no salão está quase a chegar. Por favor dirija-se ao salão.')
+MAX_TENTATIVAS = int(os.getenv('NOTIFY_MAX_RETRIES', '5'))
+RESERVA_EXPIRA = 300  # segundos até uma reserva de um despachante que caiu ser retomada
+
+def agora():
+    return datetime.now().strftime(FORMATO)
+
+# Prontas para envio: pendentes cuja tentativa já chegou, ou reservas de um
+# despachante que caiu (parâmetros: agora, limite da reserva)
+DEVIDAS = "((status = 'pendente' AND proxima_tentativa <= ?) OR (status = 'enviando' AND reservada_em < ?))"
+
+def _limites():
+    """(agora, instante antes do qual uma reserva 'enviando' expirou)"""
+    return agora(), (datetime.now() - timedelta(seconds=RESERVA_EXPIRA)).strftime(FORMATO)
+
+def enfileirar_proximos(conn, k=NOTIFY_AHEAD):
+    """
+    Regista no outbox o aviso 'proximo' dos K primeiros clientes em espera com
+    telefone (um INSERT ... SELECT sobre o índice parcial; repetidos são ignorados)
+    Retorna quantos avisos novos foram criados.
+    """
+    if k <= 0:
+        return 0
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT OR IGNORE INTO notificacoes (cliente_id, tipo, telefone, nome, proxima_tentativa)
+        SELECT id, 'proximo', telefone, nome, ?
+        FROM clientes
+        WHERE status = 'espera' AND telefone IS NOT NULL AND telefone != ''
+        ORDER BY created_at ASC, id ASC
+        LIMIT ?
+    ''', (agora(), k))
+    conn.commit()
+    return max(cur.rowcount, 0)
+
+def cancelar(cur, cliente_id):
+    """
+    Cancela os avisos ainda por enviar de um cliente removido (na transação da remoção)
+    Inclui os reservados ('enviando'): se o lote já estiver no remetente, o
+    resultado do envio já não altera o estado.
+    """
+    cur.execute('''
+        UPDATE notificacoes SET status = 'cancelada'
+        WHERE cliente_id = ? AND status IN ('pendente', 'enviando')
+    ''', (cliente_id,))
+
+
+class RemetenteStub:
+    """Remetente local para testes e desenvolvimento: regista as mensagens em memória"""
+    def __init__(self, falhar=()):
+        self.enviadas = []
+        self.falhar = set(falhar)
+
+    def enviar(self, mensagens):
+        resultado = {}
+        for m in mensagens:
+            if m['telefone'] in self.falhar:
+                resultado[m['id']] = 'falha simulada'
+            else:
+                self.enviadas.append(m)
+                logger.info('SMS para %s: %s', m['telefone'], m['texto'])
+                resultado[m['id']] = None
+        return resultado
+
+
+class RemetenteWebhook:
+    """
+    Envia cada lote como JSON para um gateway de SMS/WhatsApp (NOTIFY_WEBHOOK_URL)
+    O gateway responde {"erros": {"<id>": "motivo"}} para as mensagens recusadas.
+    """
+    def __init__(self, url=None, timeout=10):
+        self.url = url or os.environ['NOTIFY_WEBHOOK_URL']
+        self.timeout = timeout
+
+    def enviar(self, mensagens):
+        corpo = json.dumps({'mensagens': mensagens}).encode()
+        pedido = urllib.request.Request(self.url, data=corpo, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(pedido, timeout=self.timeout) as resposta:
+            erros = json.loads(resposta.read() or b'{}').get('erros', {})
+        return {m['id']: erros.get(str(m['id'])) for m in mensagens}
+
+def carregar_remetente(nome=None):
+    """
+    'stub', 'webhook' ou o caminho 'modulo:Classe' de um remetente próprio (NOTIFY_SENDER)
+    Retorna None sem remetente configurado: o stub só é usado quando pedido.
+    """
+    nome = nome or os.getenv('NOTIFY_SENDER')
+    if not nome:
+        return None
+    if nome == 'stub':
+        return RemetenteStub()
+    if nome == 'webhook':
+        return RemetenteWebhook()
+    modulo, _, classe = nome.partition(':')
+    return getattr(importlib.import_module(modulo), classe)()
+
+
+class LimiteTaxa:
+    """Balde de fichas: no máximo `taxa` mensagens por segundo, com rajadas até `rajada`"""
+    def __init__(self, taxa, rajada=None):
+        self.taxa = taxa
+        self.rajada = rajada or max(int(taxa), 1)
+        self.fichas = float(self.rajada)
+        self._ultimo = time.monotonic()
+
+    def reservar(self, n):
+        """Bloqueia até haver fichas e retorna quantas mensagens (<= n) podem seguir"""
+        while True:
+            atual = time.monotonic()
+            self.fichas = min(self.rajada, self.fichas + (atual - self._ultimo) * self.taxa)
+            self._ultimo = atual
+            if self.fichas >= 1:
+                permitidas = min(n, int(self.fichas))
+                self.fichas -= permitidas
+                return permitidas
+            time.sleep((1 - self.fichas) / self.taxa)
+
+    def devolver(self, n):
+        """Repõe fichas reservadas que não chegaram a ser usadas"""
+        self.fichas = min(self.rajada, self.fichas + n)
+
+
+class Despachante:
+    """
+    Envia os avisos pendentes do outbox em lotes, fora do caminho das rotas
+    Cada lote é reservado atomicamente (vários workers podem despachar), e as
+    falhas são repetidas com espera exponencial até MAX_TENTATIVAS.
+    Sem remetente configurado não envia nada: os avisos ficam pendentes no outbox.
+    """
+    def __init__(self, database, remetente=None, lote=50, taxa=5.0, intervalo=5.0, max_tentativas=MAX_TENTATIVAS):
+        self.database = database
+        self.remetente = remetente or carregar_remetente()
+        self.lote = lote
+        self.limite = LimiteTaxa(taxa)
+        self.intervalo = intervalo
+        self.max_tentativas = max_tentativas
+        self._acordar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def acordar(self):
+        """Pede um ciclo imediato (chamado depois de enfileirar avisos)"""
+        self._acordar.set()
+
+    def iniciar(self):
+        """Arranca a thread daemon do despachante (uma por processo)"""
+        if self.remetente is None:
+            logger.warning('NOTIFY_SENDER não configurado: os avisos ficam pendentes no outbox')
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.executar, name='notificacoes', daemon=True)
+                self._thread.start()
+
+    def executar(self):
+        """Ciclo do despachante: corre até o processo terminar"""
+        while True:
+            # Também acorda periodicamente: há avisos de outros workers e repetições agendadas
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            try:
+                while self.despachar():
+                    pass
+            except Exception:
+                logger.exception('Falha ao despachar notificações')
+
+    def despachar(self):
+        """Envia um lote; retorna quantas mensagens foram processadas"""
+        if self.remetente is None:
+            return 0
+        conn = self.database.acquire()
+        try:
+            # Leitura sem bloqueio primeiro: com o outbox vazio não há BEGIN IMMEDIATE
+            # (o lock de escrita que /next também disputa) nem fichas gastas
+            devidas = self._contar_devidas(conn, self.lote)
+            if not devidas:
+                return 0
+            fichas = self.limite.reservar(devidas)
+            pendentes = self._reservar(conn, fichas)
+            # Outro despachante pode ter reservado parte delas entretanto
+            self.limite.devolver(fichas - len(pendentes))
+            if not pendentes:
+                return 0
+            mensagens = [{'id': r['id'], 'telefone': r['telefone'],
+                          'texto': MENSAGEM.format(nome=r['nome'] or '')} for r in pendentes]
+            try:
+                resultado = self.remetente.enviar(mensagens)
+            except Exception as e:
+                logger.warning('Remetente falhou para o lote inteiro: %s', e)
+                resultado = {m['id']: str(e) or type(e).__name__ for m in mensagens}
+            self._registar(conn, pendentes, resultado)
+            return len(pendentes)
+        finally:
+            self.database.release(conn)
+
+    def _contar_devidas(self, conn, n):
+        """Quantas mensagens (até n) estão prontas para envio, sem tomar locks"""
+        momento, expirada = _limites()
+        row = conn.execute(f'''
+            SELECT COUNT(*) FROM (
+                SELECT id FROM notificacoes
+                WHERE {DEVIDAS}
+                LIMIT ?
+            ) AS devidas
+        ''', (momento, expirada, n)).fetchone()
+        return row[0]
+
+    def _reservar(self, conn, n):
+        if conn.in_transaction:
+            conn.commit()
+        momento, expirada = _limites()
+        if dialeto(conn) == 'postgresql':
+            bloqueio = 'FOR UPDATE SKIP LOCKED'
+        else:
+            conn.execute('BEGIN IMMEDIATE')
+            bloqueio = ''
+        try:
+            rows = conn.execute(f'''
+                UPDATE notificacoes SET status = 'enviando', reservada_em = ?
+                WHERE id IN (
+                    SELECT id FROM notificacoes
+                    WHERE {DEVIDAS}
+                    ORDER BY id
+                    LIMIT ?
+                    {bloqueio}
+                )
+                RETURNING id, telefone, nome, tentativas
+            ''', (momento, momento, expirada, n)).fetchall()
+            conn.commit()
+            return rows
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _registar(self, conn, pendentes, resultado):
+        momento = datetime.now()
+        with conn:
+            for r in pendentes:
+                erro = resultado.get(r['id'], 'sem resposta do remetente')
+                if erro is None:
+                    conn.execute('''
+                        UPDATE notificacoes SET status = 'enviada', enviada_em = ?, erro = NULL
+                        WHERE id = ? AND status = 'enviando'
+                    ''', (momento.strftime(FORMATO), r['id']))
+                    metrics.registry.inc('notifications_total', {'status': 'enviada'})
+                    continue
+                tentativas = r['tentativas'] + 1
+                status = 'falhou' if tentativas >= self.max_tentativas else 'pendente'
+                proxima = momento + timedelta(seconds=min(2 ** tentativas * 5, 3600))
+                conn.execute('''
+                    UPDATE notificacoes SET status = ?, tentativas = ?, proxima_tentativa = ?, erro = ?
+                    WHERE id = ? AND status = 'enviando'
+                ''', (status, tentativas, proxima.strftime(FORMATO), str(erro)[:500], r['id']))
+                metrics.registry.inc('notifications_total', {'status': status})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Despacha os avisos do outbox de notificações')
+    parser.add_argument('--db', help='ficheiro SQLite (por omissão, DATABASE_URL ou DB_PATH)')
+    parser.add_argument('--remetente', help="'stub', 'webhook' ou 'modulo:Classe' (por omissão, NOTIFY_SENDER)")
+    parser.add_argument('--taxa', type=float, default=float(os.getenv('NOTIFY_RATE', '5')), help='mensagens por segundo')
+    parser.add_argument('--uma-vez', action='store_true', help='envia o que estiver pendente e termina')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    database = Database(f'sqlite:///{args.db}', size=1) if args.db else Database.from_env(size=1)
+    remetente = carregar_remetente(args.remetente)
+    if remetente is None:
+        parser.error('indique --remetente ou NOTIFY_SENDER')
+    despachante = Despachante(database, remetente, taxa=args.taxa)
+    if args.uma_vez:
+        total = 0
+        while True:
+            enviados = despachante.despachar()
+            if not enviados:
+                break
+            total += enviados
+        print(f'{total} notificações processadas')
+    else:
+        despachante.executar()
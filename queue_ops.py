@@ -0,0 +1,81 @@
+import random
+import sqlite3
+import time
+from datetime import datetime
+
+from db import dialeto
+import stats
+
+MAX_TENTATIVAS = 5
+# SQLSTATE do PostgreSQL que vale a pena repetir: serialização, deadlock e lock indisponível
+PG_REPETIR = ('40001', '40P01', '55P03')
+
+def claim_next(conn, tentativas=MAX_TENTATIVAS):
+    """
+    Escolhe e reserva o cliente mais antigo em espera numa única transação
+    BEGIN IMMEDIATE obtém o lock de escrita antes da leitura, por isso dois
+    atendentes (ou workers) nunca chamam o mesmo cliente. Em SQLITE_BUSY a
+    operação é repetida algumas vezes com espera exponencial e jitter.
+    No PostgreSQL o lock é de linha (FOR UPDATE SKIP LOCKED), o que permite
+    vários nós da aplicação sobre a mesma base; falhas de serialização, deadlocks
+    e locks indisponíveis são repetidos da mesma forma.
+    A conexão tem de chegar sem transação aberta (ValueError caso contrário):
+    a reserva faz o seu próprio commit e não pode levar consigo escritas do chamador.
+    Retorna o cliente chamado (id, nome, telefone, servico_id, created_at,
+    atendimento_id, chamada) ou None se a fila estiver vazia.
+    """
+    for tentativa in range(tentativas):
+        try:
+            return _claim(conn)
+        except Exception as e:
+            if not _repetivel(e):
+                raise
+            if tentativa == tentativas - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** tentativa))
+
+def _repetivel(e):
+    """Conflito de locks que se resolve repetindo a transação"""
+    if isinstance(e, sqlite3.OperationalError):
+        return 'locked' in str(e) or 'busy' in str(e)
+    return getattr(e, 'pgcode', None) in PG_REPETIR
+
+def _claim(conn):
+    if conn.in_transaction:
+        raise ValueError('claim_next precisa de uma conexão sem transação aberta')
+    if dialeto(conn) == 'postgresql':
+        # O psycopg2 abre a transação sozinho
+        bloqueio = 'FOR UPDATE SKIP LOCKED'
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+        bloqueio = ''
+    try:
+        rows = conn.execute(f'''
+            UPDATE clientes SET status = 'atendimento'
+            WHERE id = (
+                SELECT id FROM clientes
+                WHERE status = 'espera'
+                ORDER BY created_at ASC, id ASC
+                LIMIT 1
+                {bloqueio}
+            )
+            RETURNING id, nome, telefone, servico_id, created_at
+        ''').fetchall()
+        if not rows:
+            conn.rollback()
+            return None
+        cliente = dict(rows[0])
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # entrada é a chegada à fila (created_at, em UTC, passado à hora local de chamada)
+        entrada = min(stats.hora_local(cliente['created_at']) or now, now)
+        cur = conn.cursor()
+        cur.execute('INSERT INTO atendimentos (cliente_id, entrada, chamada, servico_id) VALUES (?,?,?,?) RETURNING id',
+                    (cliente['id'], entrada, now, cliente['servico_id']))
+        cliente['atendimento_id'] = cur.fetchone()[0]
+        cliente['chamada'] = now
+        stats.registrar_espera(cur, entrada, now)
+        conn.commit()
+        return cliente
+    except BaseException:
+        conn.rollback()
+        raise
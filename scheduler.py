@@ -0,0 +1,205 @@
+import threading
+import time
+from datetime import datetime
+
+DURACAO_PADRAO = 30 * 60
+
+class Fenwick:
+    """Árvore de Fenwick (BIT): soma de prefixo e atualização pontual em O(log n)"""
+    def __init__(self, tamanho):
+        self.tamanho = tamanho
+        self.arvore = [0] * (tamanho + 1)
+
+    def somar(self, indice, delta):
+        i = indice + 1
+        while i <= self.tamanho:
+            self.arvore[i] += delta
+            i += i & -i
+
+    def prefixo(self, indice):
+        """Soma dos elementos nas posições [0, indice)"""
+        total = 0
+        i = indice
+        while i > 0:
+            total += self.arvore[i]
+            i -= i & -i
+        return total
+
+
+class Agendador:
+    """
+    Previsão do instante de chamada de cada cliente com N cadeiras em paralelo
+    - cada cliente ocupa uma posição (slot) pela ordem de chegada; duas árvores
+      de Fenwick sobre as posições guardam quantos clientes e quanto trabalho
+      (duração prevista) há à frente de cada um
+    - os atendimentos em curso dão o instante em que cada cadeira fica livre
+    Entrar, sair e consultar a previsão custam O(log n); nada é re-simulado.
+    """
+    def __init__(self, cadeiras=1, duracoes=None):
+        self.cadeiras = max(int(cadeiras), 1)
+        self.duracoes = duracoes or {}
+        self.carregado = False
+        self._lock = threading.RLock()
+        self._reset(64)
+
+    def _reset(self, capacidade):
+        self._capacidade = capacidade
+        self._proximo_slot = 0
+        self._slots = {}
+        self._duracao_slot = [0] * capacidade
+        self._trabalho = Fenwick(capacidade)
+        self._contagem = Fenwick(capacidade)
+        self._em_servico = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def duracao(self, servico_id):
+        """Duração prevista (segundos) de um serviço"""
+        return self.duracoes.get(servico_id) or DURACAO_PADRAO
+
+    def load(self, espera, em_servico, duracoes):
+        """
+        Reconstrói o estado: `espera` são linhas (id, servico_id) por ordem de
+        chegada; `em_servico` são linhas (id, servico_id, chamada)
+        """
+        with self._lock:
+            self.duracoes = duracoes
+            self._reset(max(64, 2 * len(espera)))
+            for r in espera:
+                self.entrar(r['id'], r['servico_id'])
+            for r in em_servico:
+                self.iniciar(r['id'], r['servico_id'], _timestamp(r['chamada']))
+            self.carregado = True
+
+    def entrar(self, cliente_id, servico_id):
+        """Cliente entra no fim da fila"""
+        with self._lock:
+            if cliente_id in self._slots:
+                return
+            if self._proximo_slot >= self._capacidade:
+                self._crescer()
+            slot = self._proximo_slot
+            self._proximo_slot += 1
+            duracao = self.duracao(servico_id)
+            self._slots[cliente_id] = slot
+            self._duracao_slot[slot] = duracao
+            self._trabalho.somar(slot, duracao)
+            self._contagem.somar(slot, 1)
+
+    def sair(self, cliente_id):
+        """Cliente sai da fila (chamado ou removido)"""
+        with self._lock:
+            slot = self._slots.pop(cliente_id, None)
+            if slot is None:
+                return
+            self._trabalho.somar(slot, -self._duracao_slot[slot])
+            self._contagem.somar(slot, -1)
+            self._duracao_slot[slot] = 0
+
+    def alterar_servico(self, cliente_id, servico_id):
+        """Atualiza a duração prevista de quem mudou de serviço"""
+        with self._lock:
+            slot = self._slots.get(cliente_id)
+            if slot is None:
+                return
+            duracao = self.duracao(servico_id)
+            self._trabalho.somar(slot, duracao - self._duracao_slot[slot])
+            self._duracao_slot[slot] = duracao
+
+    def iniciar(self, atendimento_id, servico_id, inicio=None):
+        """Um atendimento começou e ocupa uma cadeira"""
+        with self._lock:
+            inicio = time.time() if inicio is None else inicio
+            self._em_servico[atendimento_id] = inicio + self.duracao(servico_id)
+
+    def terminar(self, atendimento_id):
+        """Um atendimento terminou e liberta a cadeira"""
+        with self._lock:
+            self._em_servico.pop(atendimento_id, None)
+
+    def previsao(self, cliente_id, agora=None):
+        """
+        Espera estimada em segundos até o cliente ser chamado, ou None
+        Aproximação fluida: com k clientes à frente, se k < N o cliente espera
+        pela k-ésima cadeira a libertar-se; senão, o trabalho à frente mais o
+        restante dos atendimentos em curso é dividido pelas N cadeiras.
+        """
+        with self._lock:
+            slot = self._slots.get(cliente_id)
+            if slot is None:
+                return None
+            return self._estimar(self._contagem.prefixo(slot), self._trabalho.prefixo(slot), agora)
+
+    def previsao_nova_chegada(self, agora=None):
+        """Espera estimada para quem entrar agora no fim da fila"""
+        with self._lock:
+            fim = self._proximo_slot
+            return self._estimar(self._contagem.prefixo(fim), self._trabalho.prefixo(fim), agora)
+
+    def posicao(self, cliente_id):
+        """Posição (1 = próximo) do cliente na fila, ou None"""
+        with self._lock:
+            slot = self._slots.get(cliente_id)
+            if slot is None:
+                return None
+            return self._contagem.prefixo(slot) + 1
+
+    def _estimar(self, a_frente, trabalho, agora):
+        agora = time.time() if agora is None else agora
+        # Cadeiras ocupadas: tempo restante previsto; as restantes estão livres (0)
+        livres = sorted(max(fim - agora, 0) for fim in self._em_servico.values())[:self.cadeiras]
+        livres = [0.0] * (self.cadeiras - len(livres)) + livres
+        if a_frente < self.cadeiras:
+            return livres[a_frente]
+        return (sum(livres) + trabalho) / self.cadeiras
+
+    def _crescer(self):
+        """Duplica a capacidade e compacta as posições (O(n), amortizado)"""
+        ordem = sorted(self._slots.items(), key=lambda item: item[1])
+        duracoes = {cid: self._duracao_slot[slot] for cid, slot in ordem}
+        capacidade = max(64, 2 * (len(ordem) + 1))
+        self._capacidade = capacidade
+        self._proximo_slot = 0
+        self._slots = {}
+        self._duracao_slot = [0] * capacidade
+        self._trabalho = Fenwick(capacidade)
+        self._contagem = Fenwick(capacidade)
+        for cid, _ in ordem:
+            slot = self._proximo_slot
+            self._proximo_slot += 1
+            self._slots[cid] = slot
+            self._duracao_slot[slot] = duracoes[cid]
+            self._trabalho.somar(slot, duracoes[cid])
+            self._contagem.somar(slot, 1)
+
+
+def duracoes_servico(cur):
+    """
+    Duração prevista de cada serviço em segundos: a média móvel aprendida
+    (duration_model), a média observada no resumo diário ou, sem histórico,
+    duracao_estimada
+    """
+    cur.execute('''
+        SELECT s.id, s.duracao_estimada, d.ewma,
+               SUM(r.tempo_total) as tempo_total, SUM(r.total) as total
+        FROM servicos s
+        LEFT JOIN duracao_servico d ON d.servico_id = s.id
+        LEFT JOIN daily_rollup r ON r.servico_id = s.id AND r.tempo_total > 0
+        GROUP BY s.id, s.duracao_estimada, d.ewma
+    ''')
+    duracoes = {}
+    for row in cur.fetchall():
+        if row['ewma']:
+            duracoes[row['id']] = row['ewma']
+        elif row['total']:
+            duracoes[row['id']] = row['tempo_total'] / row['total']
+        elif row['duracao_estimada']:
+            duracoes[row['id']] = row['duracao_estimada'] * 60
+    return duracoes
+
+def _timestamp(texto):
+    try:
+        return datetime.strptime(texto, '%Y-%m-%d %H:%M:%S').timestamp()
+    except (TypeError, ValueError):
+        return time.time()
@@ -0,0 +1,158 @@
+import re
+
+from db import dialeto, tabela_existe
+import archive
+
+# Pesquisa de clientes (typeahead) por nome ou telefone.
+# - Nome: tabela FTS5 clientes_fts (sem acentos), com conteúdo em clientes_todos
+#   para incluir os arquivos mensais. Triggers em clientes mantêm-na
+#   sincronizada; o arquivo volta a indexar os clientes que move.
+#   Prefixos até PREFIXO_MAX letras têm índice próprio: sem ele o FTS5 junta as
+#   listas de todos os termos com o prefixo antes de aplicar o LIMIT.
+#   No PostgreSQL: tsvector 'simple' do nome (índice GIN) e tsquery com prefixos.
+# - Telefone: índice de expressão sobre o número só com dígitos, percorrido por
+#   intervalo de prefixo (com e sem o indicativo 258) em cada tabela.
+
+# Mesma expressão no índice e nas consultas, para o SQLite usar o índice
+TELEFONE_NORMALIZADO = "replace(replace(replace(replace(replace(replace(telefone, ' ', ''), '-', ''), '(', ''), ')', ''), '.', ''), '+', '')"
+INDICATIVO = '258'
+PREFIXO_MAX = 8
+
+SCHEMA_FTS = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS clientes_fts USING fts5(
+        nome,
+        content='clientes_todos',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='{prefixos}'
+    )
+'''.format(prefixos=' '.join(str(n) for n in range(2, PREFIXO_MAX + 1)))
+
+# Palavras do nome no PostgreSQL (a mesma expressão na consulta usa o índice)
+INDICE_NOME_PG = "CREATE INDEX IF NOT EXISTS idx_clientes_nome_tsv ON clientes USING GIN (to_tsvector('simple', nome))"
+
+TRIGGERS_FTS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS clientes_fts_ai AFTER INSERT ON clientes BEGIN
+        INSERT INTO clientes_fts (rowid, nome) VALUES (new.id, new.nome);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS clientes_fts_ad AFTER DELETE ON clientes BEGIN
+        INSERT INTO clientes_fts (clientes_fts, rowid, nome) VALUES ('delete', old.id, old.nome);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS clientes_fts_au AFTER UPDATE OF nome ON clientes BEGIN
+        INSERT INTO clientes_fts (clientes_fts, rowid, nome) VALUES ('delete', old.id, old.nome);
+        INSERT INTO clientes_fts (rowid, nome) VALUES (new.id, new.nome);
+    END
+    ''',
+)
+
+LIMITE = 20
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+def indice_telefone(tabela):
+    """Índice de expressão (parcial) do telefone normalizado de uma tabela de clientes"""
+    return (f'CREATE INDEX IF NOT EXISTS idx_{tabela}_telefone_norm '
+            f'ON {tabela} ({TELEFONE_NORMALIZADO}) WHERE telefone IS NOT NULL')
+
+def criar(conn):
+    """Cria a pesquisa (FTS5 e triggers no SQLite; índices equivalentes no PostgreSQL)"""
+    conn.execute(indice_telefone('clientes'))
+    if dialeto(conn) == 'postgresql':
+        conn.execute(INDICE_NOME_PG)
+        return
+    conn.execute(SCHEMA_FTS)
+    for trigger in TRIGGERS_FTS:
+        conn.execute(trigger)
+    conn.execute("INSERT INTO clientes_fts (clientes_fts) VALUES ('rebuild')")
+
+def indexar(conn, tabela, ids):
+    """Volta a indexar clientes movidos para `tabela` de arquivo (o DELETE da tabela viva tirou-os do FTS)"""
+    if dialeto(conn) == 'postgresql' or not ids or not tabela_existe(conn, 'clientes_fts'):
+        return
+    marcadores = ', '.join('?' * len(ids))
+    conn.execute(f'INSERT INTO clientes_fts (rowid, nome) SELECT id, nome FROM {tabela} WHERE id IN ({marcadores})',
+                 list(ids))
+
+def normalizar_telefone(texto):
+    """Só os dígitos do número, como na expressão indexada"""
+    return re.sub(r'\D', '', texto or '')
+
+def _termos(texto):
+    # Termos de uma só letra são ignorados (não têm índice de prefixo)
+    return [t for t in _TOKEN.findall(texto) if len(t) > 1]
+
+def _expressao_fts(texto):
+    """
+    'ana sil' -> '"ana"* AND "sil"*' (cada termo como prefixo, sem sintaxe FTS do utilizador)
+    Termos maiores que PREFIXO_MAX são cortados para usar o índice de prefixos.
+    """
+    return ' AND '.join(f'"{t[:PREFIXO_MAX]}"*' for t in _termos(texto))
+
+def _expressao_tsquery(texto):
+    """'Ana Sil' -> 'ana:* & sil:*' (os termos só têm letras e dígitos: nada a escapar)"""
+    return ' & '.join(f'{t.lower()}:*' for t in _termos(texto))
+
+def _seguinte(prefixo):
+    """Menor texto maior que todos os que começam por `prefixo` (limite do intervalo)"""
+    return prefixo[:-1] + chr(ord(prefixo[-1]) + 1)
+
+def pesquisar(conn, texto, limite=LIMITE):
+    """
+    Clientes (vivos e arquivados) cujo nome tem palavras começadas pelos termos
+    indicados, dos mais recentes para os mais antigos, ou cujo telefone começa
+    pelos dígitos indicados
+    """
+    texto = (texto or '').strip()
+    digitos = normalizar_telefone(texto)
+    if digitos and not re.search(r'[^\d\s()+.-]', texto):
+        return _por_telefone(conn, digitos, limite) if len(digitos) >= 3 else []
+
+    cur = conn.cursor()
+    if dialeto(conn) == 'postgresql':
+        expressao = _expressao_tsquery(texto)
+        if not expressao:
+            return []
+        cur.execute('''
+            SELECT id, nome, telefone, status, created_at FROM clientes_todos
+            WHERE to_tsvector('simple', nome) @@ to_tsquery('simple', ?)
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (expressao, limite))
+        return cur.fetchall()
+    expressao = _expressao_fts(texto)
+    if not expressao:
+        return []
+    # ORDER BY rowid segue a ordem das listas do FTS5 e pára no LIMIT (ao contrário de rank)
+    cur.execute('''
+        SELECT c.id, c.nome, c.telefone, c.status, c.created_at
+        FROM (SELECT rowid FROM clientes_fts WHERE clientes_fts MATCH ? ORDER BY rowid DESC LIMIT ?) f
+        JOIN clientes_todos c ON c.id = f.rowid
+        ORDER BY c.id DESC
+    ''', (expressao, limite))
+    return cur.fetchall()
+
+def _por_telefone(conn, digitos, limite):
+    # Números guardados com e sem indicativo
+    if digitos.startswith(INDICATIVO) and len(digitos) > len(INDICATIVO):
+        prefixos = [digitos, digitos[len(INDICATIVO):]]
+    else:
+        prefixos = [digitos, INDICATIVO + digitos]
+    cur = conn.cursor()
+    rows = []
+    # Uma consulta por tabela e prefixo: cada uma é um intervalo do índice de expressão
+    for tabela in archive.tabelas(cur, 'clientes'):
+        for prefixo in prefixos:
+            cur.execute(f'''
+                SELECT id, nome, telefone, status, created_at FROM {tabela}
+                WHERE telefone IS NOT NULL AND {TELEFONE_NORMALIZADO} >= ? AND {TELEFONE_NORMALIZADO} < ?
+                ORDER BY {TELEFONE_NORMALIZADO}
+                LIMIT ?
+            ''', (prefixo, _seguinte(prefixo), limite - len(rows)))
+            rows.extend(cur.fetchall())
+            if len(rows) >= limite:
+                return rows
+    return rows
@@ -0,0 +1,151 @@
+import argparse
+from datetime import datetime, timezone
+
+from db import Database
+
+# Agregados acumulados do tempo de espera e do tempo de atendimento.
+# Cada linha guarda somas e contagens de um período: 'global' ou um dia 'YYYY-MM-DD'.
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS estatisticas (
+        periodo TEXT PRIMARY KEY,
+        soma_espera REAL NOT NULL DEFAULT 0,
+        total_espera INTEGER NOT NULL DEFAULT 0,
+        soma_atendimento REAL NOT NULL DEFAULT 0,
+        total_atendimento INTEGER NOT NULL DEFAULT 0
+    )
+'''
+
+# Resumo diário por serviço dos atendimentos finalizados, usado pelo /report.
+# servico_id = 0 agrupa os atendimentos sem serviço definido.
+SCHEMA_ROLLUP = '''
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        dia TEXT NOT NULL,
+        servico_id INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        receita REAL NOT NULL DEFAULT 0,
+        tempo_total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, servico_id)
+    )
+'''
+
+GLOBAL = 'global'
+FORMATO = '%Y-%m-%d %H:%M:%S'
+
+def _acumular(cur, periodo, coluna_soma, coluna_total, valor):
+    cur.execute(f'''
+        INSERT INTO estatisticas (periodo, {coluna_soma}, {coluna_total}) VALUES (?, ?, 1)
+        ON CONFLICT(periodo) DO UPDATE SET
+            {coluna_soma} = estatisticas.{coluna_soma} + excluded.{coluna_soma},
+            {coluna_total} = estatisticas.{coluna_total} + 1
+    ''', (periodo, valor))
+
+def hora_local(texto):
+    """
+    Instante de clientes.created_at (CURRENT_TIMESTAMP, em UTC) na hora local do
+    servidor, como entrada/chamada/saida; a diferença horária é a da própria data
+    (horário de verão incluído). None se o texto não for uma data.
+    """
+    try:
+        instante = datetime.strptime(texto, FORMATO).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+    return instante.astimezone().strftime(FORMATO)
+
+def registrar_espera(cur, entrada, chamada):
+    """Soma o tempo de espera de um cliente chamado (mesma transação da chamada)"""
+    try:
+        segundos = (datetime.strptime(chamada, FORMATO) - datetime.strptime(entrada, FORMATO)).total_seconds()
+    except (TypeError, ValueError):
+        return
+    for periodo in (GLOBAL, chamada[:10]):
+        _acumular(cur, periodo, 'soma_espera', 'total_espera', segundos)
+
+def registrar_atendimento(cur, saida, tempo):
+    """Soma a duração de um atendimento finalizado (mesma transação da finalização)"""
+    if tempo is None:
+        return
+    for periodo in (GLOBAL, saida[:10]):
+        _acumular(cur, periodo, 'soma_atendimento', 'total_atendimento', tempo)
+
+def registrar_rollup(cur, saida, servico_id, valor_pago, tempo):
+    """Soma um atendimento finalizado ao resumo do dia (mesma transação da finalização)"""
+    cur.execute('''
+        INSERT INTO daily_rollup (dia, servico_id, total, receita, tempo_total) VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(dia, servico_id) DO UPDATE SET
+            total = daily_rollup.total + 1,
+            receita = daily_rollup.receita + excluded.receita,
+            tempo_total = daily_rollup.tempo_total + excluded.tempo_total
+    ''', (saida[:10], servico_id or 0, valor_pago or 0, tempo or 0))
+
+def media_espera(cur, periodo=GLOBAL):
+    """Tempo médio de espera em segundos - leitura O(1) de uma linha"""
+    cur.execute('SELECT soma_espera, total_espera FROM estatisticas WHERE periodo = ?', (periodo,))
+    row = cur.fetchone()
+    if not row or not row['total_espera']:
+        return None
+    return row['soma_espera'] / row['total_espera']
+
+def media_espera_sql(cur):
+    """Alternativa sem agregados: calcula a média no SQLite com julianday"""
+    cur.execute('''
+        SELECT AVG((julianday(chamada) - julianday(entrada)) * 86400.0) as media
+        FROM atendimentos_todos
+        WHERE entrada IS NOT NULL AND chamada IS NOT NULL
+    ''')
+    row = cur.fetchone()
+    return row['media'] if row else None
+
+def recalcular(conn):
+    """Reconstrói todos os agregados a partir do histórico de atendimentos"""
+    conn.execute('DELETE FROM estatisticas')
+    for chave in ("'global'", 'date(chamada)'):
+        conn.execute(f'''
+            INSERT INTO estatisticas (periodo, soma_espera, total_espera)
+            SELECT {chave}, SUM(espera), COUNT(*) FROM (
+                SELECT chamada, (julianday(chamada) - julianday(entrada)) * 86400.0 as espera
+                FROM atendimentos_todos
+                WHERE entrada IS NOT NULL AND chamada IS NOT NULL
+            ) AS esperas
+            WHERE espera IS NOT NULL
+            GROUP BY 1
+        ''')
+    for chave in ("'global'", 'date(saida)'):
+        conn.execute(f'''
+            INSERT INTO estatisticas (periodo, soma_atendimento, total_atendimento)
+            SELECT {chave}, SUM(tempo_atendimento), COUNT(*)
+            FROM atendimentos_todos
+            WHERE saida IS NOT NULL AND tempo_atendimento IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT(periodo) DO UPDATE SET
+                soma_atendimento = excluded.soma_atendimento,
+                total_atendimento = excluded.total_atendimento
+        ''')
+
+def recalcular_rollup(conn):
+    """Reconstrói o resumo diário a partir de todo o histórico de atendimentos"""
+    conn.execute('DELETE FROM daily_rollup')
+    conn.execute('''
+        INSERT INTO daily_rollup (dia, servico_id, total, receita, tempo_total)
+        SELECT date(saida), COALESCE(servico_id, 0), COUNT(*),
+               COALESCE(SUM(valor_pago), 0), COALESCE(SUM(tempo_atendimento), 0)
+        FROM atendimentos_todos
+        WHERE date(saida) IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconstrói os agregados a partir do histórico')
+    parser.add_argument('--db', help='ficheiro SQLite (por omissão, DATABASE_URL ou DB_PATH)')
+    args = parser.parse_args()
+    database = Database(f'sqlite:///{args.db}', size=1) if args.db else Database.from_env(size=1)
+    conn = database.acquire()
+    try:
+        conn.execute(SCHEMA)
+        conn.execute(SCHEMA_ROLLUP)
+        recalcular(conn)
+        recalcular_rollup(conn)
+        conn.commit()
+    finally:
+        database.release(conn)
+        database.close_all()
+    print('Agregados reconstruídos com sucesso!')
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Os módulos da aplicação estão na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importar o app abre a base e aplica as migrações: tudo numa pasta temporária,
+# sem despachante de notificações
+_PASTA = tempfile.mkdtemp(prefix='testes_salao_')
+os.environ['DB_PATH'] = os.path.join(_PASTA, 'app.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.environ["DB_PATH"]}'
+os.environ['BACKUP_DIR'] = os.path.join(_PASTA, 'backups')
+os.environ['NOTIFY_DISPATCH'] = 'off'
+
+@pytest.fixture
+def database(tmp_path):
+    """Base SQLite nova, já migrada"""
+    from db import Database
+    from init_db import init_db
+    database = Database(f'sqlite:///{tmp_path / "salao.db"}', size=4)
+    init_db(database)
+    yield database
+    database.close_all()
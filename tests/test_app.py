@@ -0,0 +1,13 @@
+import base64
+
+from app import decode_cursor, encode_cursor
+
+def test_cursor_ida_e_volta():
+    assert decode_cursor(encode_cursor('2026-01-01 10:00:00', 42)) == ['2026-01-01 10:00:00', 42]
+
+def test_cursor_invalido_conta_como_nenhum():
+    def codificar(texto):
+        return base64.urlsafe_b64encode(texto.encode()).decode()
+    for cursor in ('', 'não é base64', codificar('{'), codificar('{"a": 1}'), codificar('[1, 2]'),
+                   codificar('["x"]'), codificar('["x", "1"]'), codificar('["x", true]'), codificar('["x", 1, 2]')):
+        assert decode_cursor(cursor) is None, cursor
@@ -0,0 +1,46 @@
+import cache
+from cache import TTLCache
+
+def test_expira_depois_do_ttl(monkeypatch):
+    agora = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: agora[0])
+    c = TTLCache(ttl=5)
+    c.set('a', 1)
+    c.set('b', 2, ttl=60)
+    agora[0] += 4.9
+    assert c.get('a') == 1
+    agora[0] += 0.2
+    assert c.get('a') is None
+    assert c.get('b') == 2
+    assert len(c) == 1
+
+def test_despeja_o_menos_usado():
+    c = TTLCache(maxsize=2)
+    c.set('a', 1)
+    c.set('b', 2)
+    c.get('a')
+    c.set('c', 3)
+    assert c.get('b') is None
+    assert (c.get('a'), c.get('c')) == (1, 3)
+
+def test_invalidar():
+    c = TTLCache()
+    for k in 'abc':
+        c.set(k, k)
+    c.invalidate('a', 'x')
+    assert c.get('a') is None and c.get('b') == 'b'
+    c.invalidate()
+    assert len(c) == 0
+
+def test_get_or_set_e_estatisticas():
+    c = TTLCache()
+    chamadas = []
+    def calcular():
+        chamadas.append(1)
+        return 'valor'
+    assert c.get_or_set('k', calcular) == 'valor'
+    assert c.get_or_set('k', calcular) == 'valor'
+    assert len(chamadas) == 1
+    estado = c.stats()
+    assert (estado['hits'], estado['misses'], estado['size']) == (1, 1, 1)
+    assert estado['hit_rate'] == 0.5
@@ -0,0 +1,46 @@
+from data_structures import FilaEspera
+
+def _fila(*ids):
+    fila = FilaEspera()
+    for i in ids:
+        fila.enqueue(i, f'Cliente {i}', None, 1, f'2026-01-01 10:00:0{i}')
+    return fila
+
+def test_ordem_de_chegada():
+    fila = _fila(1, 2, 3)
+    assert len(fila) == 3
+    assert fila.peek().cliente_id == 1
+    assert [fila.dequeue().cliente_id for _ in range(3)] == [1, 2, 3]
+    assert fila.dequeue() is None
+    assert fila.peek() is None and len(fila) == 0
+
+def test_remover_em_qualquer_posicao():
+    fila = _fila(1, 2, 3, 4)
+    assert fila.remove(2).cliente_id == 2
+    assert fila.remove(4).cliente_id == 4
+    assert fila.remove(99) is None
+    assert [n.cliente_id for n in fila] == [1, 3]
+    assert 2 not in fila and 3 in fila
+    fila.enqueue(5, 'Cliente 5', None, 1, '2026-01-01 10:00:05')
+    assert [n.cliente_id for n in fila] == [1, 3, 5]
+
+def test_repetido_nao_entra_duas_vezes():
+    fila = _fila(1, 2)
+    fila.enqueue(1, 'Outro', None, 2, '2026-01-01 11:00:00')
+    assert len(fila) == 2
+    assert fila.peek()['nome'] == 'Cliente 1'
+
+def test_atualizar_mantem_posicao():
+    fila = _fila(1, 2, 3)
+    fila.update(2, 'Novo', '841234567', 3)
+    nos = fila.get_all()
+    assert [n.cliente_id for n in nos] == [1, 2, 3]
+    assert (nos[1]['nome'], nos[1]['telefone'], nos[1]['servico_id']) == ('Novo', '841234567', 3)
+    assert fila.update(99, 'x', None, 1) is None
+
+def test_carregar_substitui_o_conteudo():
+    fila = _fila(7, 8)
+    fila.load([{'id': i, 'nome': f'C{i}', 'telefone': None, 'servico_id': 1, 'created_at': ''} for i in (1, 2)])
+    assert fila.carregada
+    assert [n.cliente_id for n in fila] == [1, 2]
+    assert 7 not in fila
@@ -0,0 +1,42 @@
+import pytest
+
+from db import traduzir
+
+def test_parametros_e_percentagens():
+    assert traduzir('SELECT * FROM clientes WHERE nome LIKE ? AND id = ?') == \
+        'SELECT * FROM clientes WHERE nome LIKE %s AND id = %s'
+    assert traduzir('SELECT valor % 2 FROM t') == 'SELECT valor %% 2 FROM t'
+
+def test_literais_ficam_intactos():
+    # Dentro de literais o ? não é parâmetro; o % só é duplicado para o psycopg2
+    assert traduzir("SELECT 'quem? 50%' FROM t WHERE a = ?") == "SELECT 'quem? 50%%' FROM t WHERE a = %s"
+    assert traduzir("SELECT 'REAL', 'date(x)', 'it''s ?' FROM t") == "SELECT 'REAL', 'date(x)', 'it''s ?' FROM t"
+
+def test_funcoes_de_datas_sobre_expressoes():
+    assert traduzir('SELECT date(saida) FROM t') == 'SELECT substr(saida, 1, 10) FROM t'
+    assert traduzir('SELECT julianday(COALESCE(a.saida, ?)) FROM t') == \
+        'SELECT (EXTRACT(EPOCH FROM CAST(COALESCE(a.saida, %s) AS TIMESTAMP)) / 86400.0) FROM t'
+    assert traduzir('SELECT julianday(date(x)) FROM t') == \
+        'SELECT (EXTRACT(EPOCH FROM CAST(substr(x, 1, 10) AS TIMESTAMP)) / 86400.0) FROM t'
+    # updated( não é date(
+    assert traduzir('SELECT updated(x) FROM t') == 'SELECT updated(x) FROM t'
+
+def test_parenteses_desequilibrados():
+    with pytest.raises(ValueError):
+        traduzir('SELECT date(x FROM t')
+
+def test_insert_or_ignore():
+    assert traduzir('INSERT OR IGNORE INTO t (a) VALUES (?);') == \
+        'INSERT INTO t (a) VALUES (%s) ON CONFLICT DO NOTHING'
+    # Com SELECT (ORDER BY/LIMIT fazem parte da consulta) a cláusula vai no fim
+    assert traduzir('INSERT OR IGNORE INTO t (a) SELECT a FROM u ORDER BY a LIMIT 5') == \
+        'INSERT INTO t (a) SELECT a FROM u ORDER BY a LIMIT 5 ON CONFLICT DO NOTHING'
+    # ... mas antes do RETURNING
+    assert traduzir('INSERT OR IGNORE INTO t (a) SELECT a FROM u LIMIT 5 RETURNING id') == \
+        'INSERT INTO t (a) SELECT a FROM u LIMIT 5 ON CONFLICT DO NOTHING RETURNING id'
+
+def test_esquema():
+    assert traduzir('CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT, v REAL, b BLOB, '
+                    'c TEXT DEFAULT CURRENT_TIMESTAMP)') == (
+        'CREATE TABLE t (id SERIAL PRIMARY KEY, v DOUBLE PRECISION, b BYTEA, '
+        "c TEXT DEFAULT to_char(CURRENT_TIMESTAMP AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'))")
@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from queue_ops import claim_next
+
+def _inserir(database, n):
+    conn = database.acquire()
+    conn.executemany('INSERT INTO clientes (nome, telefone, servico_id, created_at) VALUES (?, ?, 1, ?)',
+                     [(f'Cliente {i}', None, f'2026-01-01 10:{i // 60:02d}:{i % 60:02d}') for i in range(n)])
+    conn.commit()
+    database.release(conn)
+
+def test_chama_por_ordem_de_chegada(database):
+    _inserir(database, 3)
+    conn = database.acquire()
+    chamados = [claim_next(conn)['nome'] for _ in range(3)]
+    assert chamados == ['Cliente 0', 'Cliente 1', 'Cliente 2']
+    assert claim_next(conn) is None
+    row = conn.execute("SELECT COUNT(*) FROM atendimentos WHERE entrada < chamada").fetchone()
+    assert row[0] == 3
+    database.release(conn)
+
+def test_nunca_chama_o_mesmo_cliente_duas_vezes(database):
+    _inserir(database, 60)
+    chamados = []
+    erros = []
+
+    def atendente():
+        conn = database.acquire()
+        try:
+            while True:
+                cliente = claim_next(conn)
+                if cliente is None:
+                    return
+                chamados.append(cliente['id'])
+        except Exception as e:
+            erros.append(e)
+        finally:
+            database.release(conn)
+
+    threads = [threading.Thread(target=atendente) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not erros
+    assert len(chamados) == len(set(chamados)) == 60
+    conn = database.acquire()
+    assert conn.execute('SELECT COUNT(DISTINCT cliente_id), COUNT(*) FROM atendimentos').fetchone()[:] == (60, 60)
+    database.release(conn)
+
+def test_recusa_transacao_aberta(database):
+    _inserir(database, 1)
+    conn = database.acquire()
+    conn.execute("UPDATE clientes SET nome = 'pendente'")
+    with pytest.raises(ValueError):
+        claim_next(conn)
+    conn.rollback()
+    database.release(conn)
@@ -0,0 +1,48 @@
+from scheduler import Agendador, DURACAO_PADRAO
+
+DURACOES = {1: 600, 2: 1200}
+
+def test_posicao_e_previsao_com_uma_cadeira():
+    a = Agendador(cadeiras=1, duracoes=DURACOES)
+    a.entrar(10, 1)
+    a.entrar(11, 2)
+    a.entrar(12, 3)
+    assert [a.posicao(c) for c in (10, 11, 12)] == [1, 2, 3]
+    assert [a.previsao(c, agora=0) for c in (10, 11, 12)] == [0, 600, 1800]
+    assert a.previsao_nova_chegada(agora=0) == 1800 + DURACAO_PADRAO
+    assert a.posicao(99) is None and a.previsao(99) is None
+
+def test_sair_e_alterar_servico():
+    a = Agendador(cadeiras=1, duracoes=DURACOES)
+    for c in (10, 11, 12):
+        a.entrar(c, 1)
+    a.sair(10)
+    assert a.posicao(12) == 2
+    assert a.previsao(12, agora=0) == 600
+    a.alterar_servico(11, 2)
+    assert a.previsao(12, agora=0) == 1200
+    assert len(a) == 2
+
+def test_varias_cadeiras_e_atendimentos_em_curso():
+    a = Agendador(cadeiras=2, duracoes=DURACOES)
+    a.iniciar(1, 1, inicio=1000)
+    for c in (10, 11, 12):
+        a.entrar(c, 2)
+    # Uma cadeira livre, outra livre daqui a 600 s
+    assert a.previsao(10, agora=1000) == 0
+    assert a.previsao(11, agora=1000) == 600
+    # Dois à frente: (0 + 600 + 2 * 1200) / 2
+    assert a.previsao(12, agora=1000) == 1500
+    a.terminar(1)
+    assert a.previsao(11, agora=1000) == 0
+
+def test_cresce_alem_da_capacidade_inicial():
+    a = Agendador(cadeiras=1, duracoes=DURACOES)
+    for c in range(200):
+        a.entrar(c, 1)
+    for c in range(0, 100, 2):
+        a.sair(c)
+    a.entrar(500, 1)
+    assert len(a) == 151
+    assert a.posicao(500) == 151
+    assert a.previsao(500, agora=0) == 150 * 600
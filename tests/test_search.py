@@ -0,0 +1,25 @@
+import search
+from search import _expressao_fts, _expressao_tsquery
+
+def test_expressao_fts():
+    assert _expressao_fts('ana sil') == '"ana"* AND "sil"*'
+    # Sintaxe FTS do utilizador é descartada; termos de uma letra são ignorados
+    assert _expressao_fts('ana" OR x* NEAR(') == '"ana"* AND "OR"* AND "NEAR"*'
+    assert _expressao_fts('a b') == ''
+    assert _expressao_fts('Albertina') == '"Albertin"*'
+
+def test_expressao_tsquery():
+    assert _expressao_tsquery('Ana Sil') == 'ana:* & sil:*'
+    assert _expressao_tsquery("o'neil & | !") == 'neil:*'
+
+def test_pesquisa_por_palavra_e_telefone(database):
+    conn = database.acquire()
+    conn.executemany('INSERT INTO clientes (nome, telefone) VALUES (?, ?)',
+                     [('Ana Silva', '+258 84 123 4567'), ('Silvano Mucavel', None), ('Bruno Ana', '821112222')])
+    conn.commit()
+    assert {r['nome'] for r in search.pesquisar(conn, 'silva')} == {'Ana Silva', 'Silvano Mucavel'}
+    assert [r['nome'] for r in search.pesquisar(conn, 'ana sil')] == ['Ana Silva']
+    assert [r['nome'] for r in search.pesquisar(conn, '841234')] == ['Ana Silva']
+    assert [r['nome'] for r in search.pesquisar(conn, '258 82')] == ['Bruno Ana']
+    assert search.pesquisar(conn, '') == []
+    database.release(conn)